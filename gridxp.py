@@ -1,17 +1,28 @@
 #!/usr/bin/env python3
 
-from sys import stderr, stdout
-import itertools
-from collections import OrderedDict
+from sys import stderr, stdout, exit
+import sys
+from collections import OrderedDict, defaultdict
 import os.path
 import subprocess
 from os import makedirs, listdir, remove
 from argparse import ArgumentParser
 from datetime import datetime
 import shutil
+import time
+import hashlib
+import tempfile
+import json
+import shlex
+import heapq
+import resource
+import signal
+from array import array
 import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 try:
-    from qsync import QSync
+    from qsync import QSync, backend_available
 except ImportError:
     QSync = None
 
@@ -70,7 +81,404 @@ class ObjectDict(dict):
             return self[name]
         raise AttributeError(name)
 
-        
+
+class CellRecord:
+    def __init__(self, key, signature, start):
+        self.key = key
+        self.signature = signature
+        self.start = start
+        self.end = None
+        self.exit_code = None
+        self.utime = None
+        self.stime = None
+        self.maxrss = None
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def status(self, signature):
+        if self.end is None:
+            return 'unfinished'
+        if self.exit_code != 0:
+            return 'failed'
+        if self.signature != signature:
+            return 'changed'
+        return 'done'
+
+
+class RunState:
+    '''Append-only journal of cell executions.
+
+    Each line is either 'start KEY TIME SIGNATURE' or 'end KEY TIME EXIT_CODE [UTIME STIME MAXRSS]', separated by tabs.
+    UTIME and STIME are the user and system CPU times in seconds, MAXRSS is the maximum resident set size in kilobytes, or '-' if unknown.
+    The journal is loaded once, the last execution of each cell wins.
+    '''
+    def __init__(self, filename, write=True):
+        self.filename = filename
+        self.records = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    self._read_line(line.rstrip('\n').split('\t'))
+        if write:
+            self.journal = open(filename, 'a')
+        else:
+            self.journal = None
+
+    def _read_line(self, cols):
+        if cols[0] == 'start' and len(cols) >= 4:
+            self.records[cols[1]] = CellRecord(cols[1], cols[3], float(cols[2]))
+        elif cols[0] == 'end' and len(cols) >= 4 and cols[1] in self.records:
+            record = self.records[cols[1]]
+            record.end = float(cols[2])
+            record.exit_code = int(cols[3])
+            if len(cols) >= 7:
+                record.utime = float(cols[4])
+                record.stime = float(cols[5])
+                record.maxrss = None if cols[6] == '-' else int(cols[6])
+
+    def _write(self, *cols):
+        self.journal.write('\t'.join(str(c) for c in cols))
+        self.journal.write('\n')
+        self.journal.flush()
+
+    def status(self, key, signature):
+        if key in self.records:
+            return self.records[key].status(signature)
+        return None
+
+    def start(self, key, signature, t=None):
+        record = CellRecord(key, signature, time.time() if t is None else t)
+        self.records[key] = record
+        if self.journal is not None:
+            self._write('start', key, record.start, signature)
+
+    def end(self, key, exit_code, t=None, usage=None):
+        record = self.records[key]
+        record.end = time.time() if t is None else t
+        record.exit_code = exit_code
+        if usage is not None:
+            record.utime, record.stime, record.maxrss = usage
+        if self.journal is None:
+            return
+        if usage is None:
+            self._write('end', key, record.end, exit_code)
+        else:
+            self._write('end', key, record.end, exit_code, record.utime, record.stime, '-' if record.maxrss is None else record.maxrss)
+
+    def merge(self, filename):
+        '''Adds the records of a journal written by another process.'''
+        with open(filename) as f:
+            for line in f:
+                cols = line.rstrip('\n').split('\t')
+                self._read_line(cols)
+                if self.journal is not None:
+                    self._write(*cols)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+def parse_size(s):
+    if isinstance(s, int):
+        return s
+    s = s.strip().upper()
+    for i, unit in enumerate('KMGT'):
+        if s.endswith(unit):
+            return int(float(s[:-1]) * 1024 ** (i + 1))
+    return int(s)
+
+
+class ResultCache:
+    '''Content-addressed store of cell outputs.
+
+    Entries are directories named after a digest of the expanded command line, of the contents of the input files and of the names of the output files.
+    The modification time of an entry is the time it was last used, least recently used entries are evicted when the cache exceeds its maximum size.
+    '''
+    def __init__(self, dirname, max_size=None):
+        self.dirname = dirname
+        self.max_size = max_size
+        self.digests = {}
+        if not os.path.exists(dirname):
+            makedirs(dirname)
+        self.entries = {}
+        for key in listdir(dirname):
+            entry = os.path.join(dirname, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            self.entries[key] = [os.path.getmtime(entry), ResultCache._entry_size(entry)]
+        self.evict()
+
+    @staticmethod
+    def _entry_size(entry):
+        return sum(os.path.getsize(os.path.join(entry, fn)) for fn in listdir(entry))
+
+    @staticmethod
+    def _link_or_copy(src, dst):
+        if os.path.lexists(dst):
+            remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def file_digest(self, filename):
+        st = os.stat(filename)
+        k = (filename, st.st_mtime_ns, st.st_size)
+        if k not in self.digests:
+            h = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            self.digests[k] = h.hexdigest()
+        return self.digests[k]
+
+    def key(self, cl, inputs, outputs):
+        h = hashlib.sha256(cl.encode('utf-8'))
+        for fn in inputs:
+            h.update(b'\0' + self.file_digest(fn).encode('ascii'))
+        for fn in outputs:
+            h.update(b'\1' + os.path.basename(fn).encode('utf-8'))
+        return h.hexdigest()
+
+    def fetch(self, key, outputs):
+        if key not in self.entries:
+            return False
+        entry = os.path.join(self.dirname, key)
+        cached = tuple(os.path.join(entry, str(i)) for i in range(len(outputs)))
+        if not all(os.path.exists(fn) for fn in cached):
+            return False
+        try:
+            for src, dst in zip(cached, outputs):
+                ResultCache._link_or_copy(src, dst)
+            os.utime(entry)
+        except OSError as e:
+            # evicted by another process sharing the cache
+            log('(cache) cannot fetch %s: %s' % (key, e))
+            self.entries.pop(key, None)
+            return False
+        self.entries[key][0] = time.time()
+        return True
+
+    def store(self, key, outputs):
+        if key in self.entries:
+            return
+        for fn in outputs:
+            if not os.path.exists(fn):
+                log('(cache) missing output %s, not caching' % fn)
+                return
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.dirname)
+        for i, fn in enumerate(outputs):
+            shutil.copyfile(fn, os.path.join(tmp, str(i)))
+        entry = os.path.join(self.dirname, key)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp)
+            return
+        self.entries[key] = [time.time(), ResultCache._entry_size(entry)]
+        self.evict()
+
+    def evict(self):
+        if self.max_size is None:
+            return
+        total = sum(size for (_, size) in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k][0]):
+            if total <= self.max_size:
+                break
+            log('(cache) evicting ' + key)
+            shutil.rmtree(os.path.join(self.dirname, key), ignore_errors=True)
+            total -= self.entries.pop(key)[1]
+
+
+def parse_cell_key(params, sep, key):
+    '''Returns the formatted parameter values of a cell key, or None if the key does not match the parameters.'''
+    dirnames = key.split('/')
+    if len(dirnames) != len(params):
+        return None
+    result = []
+    for p, dirname in zip(params, dirnames):
+        prefix = p.name + sep
+        if not dirname.startswith(prefix):
+            return None
+        result.append(dirname[len(prefix):])
+    return result
+
+
+def wait_usage(p, block=True):
+    '''Waits for a subprocess, like Popen.wait() or Popen.poll().
+
+    Returns the resource usage of the subprocess as (user time, system time, max RSS), or None if it is still running.
+    '''
+    pid, status, ru = os.wait4(p.pid, 0 if block else os.WNOHANG)
+    if pid == 0:
+        return None
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return ru.ru_utime, ru.ru_stime, ru.ru_maxrss
+
+
+def self_usage(before=None):
+    '''Returns the resource usage of this process, minus CPU times in before.
+
+    The maximum RSS is the peak of the whole process, so it is None when before is given, since it cannot be attributed to a cell.
+    '''
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    if before is None:
+        return ru.ru_utime, ru.ru_stime, ru.ru_maxrss
+    return ru.ru_utime - before[0], ru.ru_stime - before[1], None
+
+
+class CostModel:
+    '''Multiplicative model of cell durations.
+
+    The predicted duration of a cell is the mean duration of all recorded cells, multiplied for each parameter by the ratio between the mean duration of cells with the same value and the overall mean.
+    '''
+    def __init__(self, params, sep, records):
+        self.params = tuple(params)
+        totals = defaultdict(float)
+        counts = defaultdict(int)
+        total = 0.0
+        n = 0
+        for r in records:
+            if r.exit_code != 0 or r.duration is None:
+                continue
+            svalues = parse_cell_key(self.params, sep, r.key)
+            if svalues is None:
+                continue
+            for k in zip((p.name for p in self.params), svalues):
+                totals[k] += r.duration
+                counts[k] += 1
+            total += r.duration
+            n += 1
+        self.mean = total / n if n > 0 else None
+        self.factors = dict((k, (totals[k] / counts[k]) / self.mean) for k in totals if self.mean > 0)
+
+    def empty(self):
+        return self.mean is None
+
+    def predict(self):
+        '''Predicts the duration of the cell for the current parameter values.'''
+        result = self.mean
+        for p in self.params:
+            result *= self.factors.get((p.name, p.svalue()), 1.0)
+        return result
+
+    @staticmethod
+    def makespan(costs, jobs):
+        '''Duration of a longest-processing-time-first schedule of costs on jobs workers.'''
+        workers = [0.0] * jobs
+        for c in sorted(costs, reverse=True):
+            heapq.heappush(workers, heapq.heappop(workers) + c)
+        return max(workers)
+
+
+class CellTable:
+    '''Cells executed by array job tasks or batch jobs.
+
+    The table file contains one JSON object per cell and per line, cells of the same task are contiguous.
+    The index file contains the offset of the first line of each task as 8-byte integers.
+    Each task writes the journal of its cells in a separate file of the status directory, see RunState.
+    '''
+    FILENAME = 'gridxp.cells'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.status_dir = filename + '.status'
+
+    def write(self, tasks, state=None):
+        '''Writes the cells of each task, status files left by a previous run are first merged into state, or kept if state is None.'''
+        if os.path.exists(self.status_dir):
+            if state is not None:
+                self.merge_status(state)
+        else:
+            makedirs(self.status_dir)
+        offsets = array('q')
+        with open(self.filename, 'wb') as f:
+            for rows in tasks:
+                offsets.append(f.tell())
+                for row in rows:
+                    f.write(json.dumps(row).encode('utf-8'))
+                    f.write(b'\n')
+        with open(self.index_filename, 'wb') as f:
+            offsets.tofile(f)
+        return len(offsets)
+
+    def read(self, task_id):
+        offsets = array('q')
+        with open(self.index_filename, 'rb') as f:
+            f.seek((task_id - 1) * offsets.itemsize)
+            offsets.frombytes(f.read(2 * offsets.itemsize))
+        if len(offsets) == 0:
+            raise ValueError('no task %d in %s' % (task_id, self.filename))
+        with open(self.filename, 'rb') as f:
+            f.seek(offsets[0])
+            while len(offsets) == 1 or f.tell() < offsets[1]:
+                line = f.readline()
+                if not line:
+                    break
+                yield json.loads(line.decode('utf-8'))
+
+    def status_filename(self, task_id):
+        return os.path.join(self.status_dir, str(task_id))
+
+    def merge_status(self, state, keep=False):
+        for fn in listdir(self.status_dir):
+            if state is not None:
+                state.merge(os.path.join(self.status_dir, fn))
+            if not keep:
+                remove(os.path.join(self.status_dir, fn))
+
+
+def _start_cell(row, status):
+    out = None if row['out'] is None else open(row['out'], 'w')
+    err = None if row['err'] is None else open(row['err'], 'w')
+    status.start(row['key'], row['signature'])
+    p = subprocess.Popen(row['cl'], shell=True, executable=row['shell'], stdout=out, stderr=err, close_fds=True)
+    for f in (out, err):
+        if f is not None:
+            f.close()
+    return p, row
+
+
+def _wait_cell(running, status):
+    while True:
+        for i, (p, row) in enumerate(running):
+            usage = wait_usage(p, False)
+            if usage is not None:
+                del running[i]
+                status.end(row['key'], p.returncode, usage=usage)
+                if p.returncode != 0:
+                    log('cell %s has FAILED' % row['key'])
+                if p.returncode < 0:
+                    return 128 - p.returncode
+                return p.returncode
+        time.sleep(0.05)
+
+
+def run_cells(table_filename, task_id, jobs=1):
+    '''Executes the cells of an array job task or of a batch job, returns the exit status of the first failed cell.'''
+    table = CellTable(table_filename)
+    status = RunState(table.status_filename(task_id))
+    exit_codes = []
+    running = []
+    try:
+        for row in table.read(task_id):
+            while len(running) >= jobs:
+                exit_codes.append(_wait_cell(running, status))
+            running.append(_start_cell(row, status))
+        while running:
+            exit_codes.append(_wait_cell(running, status))
+    finally:
+        status.close()
+    return next((c for c in exit_codes if c != 0), 0)
+
+
 class Experiment:
     def __init__(self):
         self.params = OrderedDict()
@@ -89,29 +497,73 @@ class Experiment:
             else:
                 raise ValueError('no param %s' % name)
 
-    def accept_params(self, pvs):
-        paramdict = ObjectDict(zip(self.params.keys(), pvs))
-        for f in self.accept:
-            if not f(paramdict):
-                return False
-        return True
-    
-    def cells(self):
+    def add_accept(self, fun, depends=None):
+        if depends is not None:
+            depends = tuple(depends)
+        self.accept.append((fun, depends))
+
+    def _accept_levels(self, params):
+        index = dict((p.name, i) for (i, p) in enumerate(params))
+        levels = tuple([] for _ in params)
+        for f, depends in self.accept:
+            if depends is None:
+                level = len(params) - 1
+            else:
+                for name in depends:
+                    if name not in index:
+                        raise ValueError('accept function depends on unknown param %s' % name)
+                level = max((index[name] for name in depends), default=0)
+            levels[level].append(f)
+        return levels
+
+    def _accepted_values(self, params, levels, prefix=()):
+        k = len(prefix)
+        funs = levels[k]
+        last = k == len(params) - 1
+        for v in params[k].values:
+            pvs = prefix + (v,)
+            if funs:
+                paramdict = ObjectDict(zip(self.params.keys(), pvs))
+                if not all(f(paramdict) for f in funs):
+                    continue
+            if last:
+                yield pvs
+            else:
+                yield from self._accepted_values(params, levels, pvs)
+
+    def _check_values(self):
         for p in self.params.values():
             if len(p.values) == 0:
                 raise ValueError('empty values for %s' % p.name)
-        paramvalues = tuple(p.values for p in self.params.values())
-        for pvs in itertools.product(*paramvalues):
-            if self.accept_params(pvs):        
-                for p, v in zip(self.params.values(), pvs):
-                    p.set_value(v)
-                yield None
+        return tuple(self.params.values())
+
+    def cells(self):
+        params = self._check_values()
+        levels = self._accept_levels(params)
+        for pvs in self._accepted_values(params, levels):
+            for p, v in zip(params, pvs):
+                p.set_value(v)
+            yield None
+
+    def count_cells(self):
+        params = self._check_values()
+        levels = self._accept_levels(params)
+        bound = max((i + 1 for (i, funs) in enumerate(levels) if funs), default=0)
+        result = 1
+        for p in params[bound:]:
+            result *= len(p.values)
+        if bound > 0:
+            result *= sum(1 for _ in self._accepted_values(params[:bound], levels[:bound]))
+        return result
+
+    def cell_label(self):
+        return ', '.join(('%s=%s' % (p.name, p.svalue())) for p in self.params.values())
 
     def run(self, test=False):
         log('running pre-process')
         self.pre()
-        for _ in self.cells():
-            log('running process for ' + ', '.join(('%s=%s' % (p.name, p.svalue())) for p in self.params.values()))
+        for _ in self.ordered_cells():
+            log('running process for ' + self.cell_label())
             self.exe()
             if test:
                 log('(test) stop')
@@ -119,6 +571,9 @@ class Experiment:
         log('running post-process')
         self.post()
 
+    def ordered_cells(self):
+        return self.cells()
+
     def test(self, values=None):
         self.run(test=True, values=values)
 
@@ -150,11 +605,26 @@ class ExperimentConfig(Experiment):
         self.job_opts = None
         self.qsync_filename = 'gridxp.qsync'
         self.qsync_opts = {}
+        self.array_job = False
+        self.batch_size = 1
+        self.batch_duration = 300
+        self.longest_first = False
         self.executor = None
         self.dry_run = False
         self.properties = {}
+        self.property_depends = {}
+        self.property_values = {}
+        self.known_dirs = set()
         self.update = False
         self.delete_out = False
+        self.jobs = 1
+        self.state_filename = 'gridxp.state'
+        self.state = None
+        self.cache_dir = None
+        self.cache_size = None
+        self.cache_inputs = ()
+        self.cache_outputs = ()
+        self.cache = None
 
     def load_config(self, filename):
         found = searchfile(filename)
@@ -176,6 +646,7 @@ class ExperimentConfig(Experiment):
         jo = self._attrsetter('job_opts')
         qf = self._attrsetter('qsync_filename')
         delo = self._attrsetter('delete_out')
+        sf = self._attrsetter('state_filename')
         param = self._paramdef()
         pv = self._paramvaluessetter()
         pa = self._paramaccept()
@@ -196,11 +667,21 @@ class ExperimentConfig(Experiment):
             job_opts=jo, job_options=jo,
             qf=qf, qsync_filename=qf, qsync_file=qf,
             delete_out=delo, delete_output=delo,
+            state_file=sf, state_filename=sf,
+            cache_dir=self._attrsetter('cache_dir'),
+            cache_size=self._attrsetter('cache_size'),
+            cache_inputs=self._varattrsetter('cache_inputs'),
+            cache_outputs=self._varattrsetter('cache_outputs'),
             paramvalues=pv, param_values=pv,
             paramaccept=pa, param_accept=pa,
             prop=prop, property=prop,
             qsync_opts=self._qsync_opts(),
+            array_job=(lambda value=True: setattr(self, 'array_job', value)),
+            batch_size=self._attrsetter('batch_size'), batch=self._attrsetter('batch_size'),
+            batch_duration=self._attrsetter('batch_duration'),
+            longest_first=(lambda value=True: setattr(self, 'longest_first', value)),
             local=self.local_execution,
+            parallel=self._attrsetter('jobs'), jobs=self._attrsetter('jobs'),
             include=(lambda filename: self.load_config(filename)),
             dry_run=self._attrsetter('dry_run'),
         )
@@ -211,14 +692,21 @@ class ExperimentConfig(Experiment):
     def _attrsetter(self, name):
         return lambda value: setattr(self, name, value)
 
+    def _varattrsetter(self, name):
+        return lambda *values: setattr(self, name, values)
+
     def _propdef(self):
-        def result(name, fun):
+        def result(name, fun, depends=None):
             self.properties[name] = fun
+            if depends is None:
+                self.property_depends.pop(name, None)
+            else:
+                self.property_depends[name] = tuple(depends)
         return result
 
     def _paramaccept(self):
-        def result(fun):
-            self.accept.append(fun)
+        def result(fun, depends=None):
+            self.add_accept(fun, depends)
         return result
 
     def _paramdef(self):
@@ -243,8 +731,9 @@ class ExperimentConfig(Experiment):
     def _delete_output_file(self, d, filename):
         if self.delete_out and filename is not None:
             xfn = ExperimentConfig.expand(d, filename)
-            log('deleting ' + xfn)
-            remove(xfn)
+            if os.path.exists(xfn):
+                log('deleting ' + xfn)
+                remove(xfn)
             
     @staticmethod
     def expand(d, s):
@@ -260,6 +749,183 @@ class ExperimentConfig(Experiment):
     def _param_dirname(self, p):
         return p.name + self.sep + p.svalue()
 
+    def cell_key(self):
+        return '/'.join(self._param_dirname(p) for p in self.params.values())
+
+    def _cell_signature(self, d):
+        if self.cl is not None:
+            parts = [self.cl]
+        else:
+            parts = [getattr(self.fun, '__name__', repr(self.fun))]
+        for s in (self.cl, self.out, self.err):
+            if s is not None:
+                parts.append(ExperimentConfig.expand(d, s))
+        if self.cl is None:
+            # only strings, reprs of functions and objects change from one run to the next
+            for name in self.params:
+                parts.append('%s=%s %s' % (name, d['s_' + name], d['d_' + name]))
+            parts.extend('%s=%s' % (k, v) for (k, v) in sorted(d.items()) if k in self.properties and isinstance(v, str))
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def _record_start(self, d):
+        if self.state is None:
+            return None
+        key = self.cell_key()
+        self.state.start(key, self._cell_signature(d))
+        return key
+
+    def _record_end(self, key, exit_code, usage=None):
+        if key is not None:
+            self.state.end(key, exit_code, usage=usage)
+
+    def _open_cache(self):
+        if self.cache_dir is None or self.dry_run:
+            return
+        max_size = None if self.cache_size is None else parse_size(self.cache_size)
+        self.cache = ResultCache(os.path.expanduser(os.path.expandvars(self.cache_dir)), max_size)
+
+    def _cache_fetch(self, d, cl):
+        '''Fetches the outputs of the current cell from the result cache.
+
+        Returns a pair (hit, entry), entry must be passed to _cache_store() once the cell has succeeded.
+        '''
+        if self.cache is None:
+            return False, None
+        outputs = tuple(ExperimentConfig.expand(d, s) for s in self.cache_outputs + (self.out, self.err) if s is not None)
+        try:
+            key = self.cache.key('%s\n%s' % (self.shell, cl), (ExperimentConfig.expand(d, s) for s in self.cache_inputs), outputs)
+        except OSError as e:
+            log('(cache) cannot compute key: %s' % e)
+            return False, None
+        if self.cache.fetch(key, outputs):
+            self._record_end(self._record_start(d), 0)
+            return True, None
+        for fn in outputs:
+            if os.path.exists(fn) and os.stat(fn).st_nlink > 1:
+                remove(fn)
+        return False, (key, outputs)
+
+    def _cache_store(self, entry):
+        if entry is not None:
+            self.cache.store(*entry)
+
+    def cost_model(self):
+        records = () if self.state is None else self.state.records.values()
+        return CostModel(self.params.values(), self.sep, records)
+
+    def ordered_cells(self):
+        if not self.longest_first:
+            return self.cells()
+        return self._longest_first_cells()
+
+    def _longest_first_cells(self):
+        model = self.cost_model()
+        if model.empty():
+            log('no previous timings, cells in declaration order')
+            yield from self.cells()
+            return
+        params = tuple(self.params.values())
+        cells = []
+        for _ in self.cells():
+            cells.append((model.predict(), tuple(p.current for p in params)))
+        cells.sort(key=lambda c: c[0], reverse=True)
+        for _, pvs in cells:
+            for p, v in zip(params, pvs):
+                p.set_value(v)
+            yield None
+
+    def predict(self):
+        '''Returns the predicted total duration, longest cell duration and duration with parallel cells, or None if there are no previous timings.'''
+        filename = self._state_filepath()
+        if filename is not None and os.path.exists(filename):
+            self.state = RunState(filename, write=False)
+        model = self.cost_model()
+        if model.empty():
+            return None
+        costs = [model.predict() for _ in self.cells()]
+        return sum(costs), max(costs), CostModel.makespan(costs, self.jobs)
+
+    def report(self, out):
+        '''Writes a summary of the cells recorded in the state file, by parameter value.'''
+        if self.output_dir is None:
+            raise ValueError('no state file without an output directory')
+        filename = self._state_filepath()
+        if filename is None or not os.path.exists(filename):
+            raise ValueError('no state file')
+        state = RunState(filename, write=False)
+        params = tuple(self.params.values())
+        cells = []
+        for r in state.records.values():
+            svalues = parse_cell_key(params, self.sep, r.key)
+            if svalues is not None and r.end is not None:
+                cells.append((svalues, r))
+        failed = sum(1 for (_, r) in cells if r.exit_code != 0)
+        out.write('%d cells finished, %d failed\n' % (len(cells), failed))
+        for i, p in enumerate(params):
+            values = OrderedDict()
+            for svalues, r in cells:
+                values.setdefault(svalues[i], []).append(r)
+            out.write('\n%s\n' % p.name)
+            width = max([len('value')] + [len(v) for v in values])
+            out.write('  %-*s %6s %7s %10s %10s %10s %10s\n' % (width, 'value', 'cells', 'failed', 'mean wall', 'max wall', 'mean cpu', 'max rss'))
+            rows = []
+            for v, records in values.items():
+                walls = [r.duration for r in records]
+                cpus = [r.utime + r.stime for r in records if r.utime is not None]
+                rss = [r.maxrss for r in records if r.maxrss is not None]
+                rows.append((sum(walls) / len(walls), v, records, walls, cpus, rss))
+            rows.sort(key=lambda row: row[0], reverse=True)
+            for mean_wall, v, records, walls, cpus, rss in rows:
+                nfailed = sum(1 for r in records if r.exit_code != 0)
+                out.write('  %-*s %6d %6.1f%% %9.1fs %9.1fs %10s %10s\n' % (width, v, len(records), 100.0 * nfailed / len(records), mean_wall, max(walls), ('%.1fs' % (sum(cpus) / len(cpus))) if cpus else '-', ('%.1fM' % (max(rss) / 1024.0)) if rss else '-'))
+        rss = sorted(r.maxrss for (_, r) in cells if r.maxrss)
+        if rss:
+            median = rss[len(rss) // 2]
+            outliers = sorted((r for (_, r) in cells if r.maxrss and r.maxrss > 2 * median), key=lambda r: r.maxrss, reverse=True)
+            out.write('\nmemory outliers (max rss above twice the median %.1fM)\n' % (median / 1024.0))
+            for r in outliers[:20]:
+                out.write('  %s %.1fM\n' % (r.key, r.maxrss / 1024.0))
+
+    def _state_filepath(self):
+        if self.state_filename is None or self.output_dir is None:
+            return None
+        return os.path.join(self.output_dir, self.state_filename)
+
+    def _open_state(self):
+        filename = self._state_filepath()
+        if filename is None:
+            return
+        if self.dry_run:
+            if os.path.exists(filename):
+                self.state = RunState(filename, write=False)
+        else:
+            if not os.path.exists(self.output_dir):
+                makedirs(self.output_dir)
+            self.state = RunState(filename)
+        # cells finished by the tasks of an interrupted run
+        table = CellTable(os.path.join(self.output_dir, CellTable.FILENAME))
+        if self.state is not None and os.path.isdir(table.status_dir):
+            table.merge_status(self.state, keep=self.dry_run)
+
+    def _makedirs(self, d):
+        if d not in self.known_dirs:
+            makedirs(d, exist_ok=True)
+            self.known_dirs.add(d)
+
+    def _property_value(self, name, fun, params):
+        if name not in self.property_depends:
+            return fun(params)
+        try:
+            k = (name,) + tuple(params[n] for n in self.property_depends[name])
+            hash(k)
+        except KeyError as e:
+            raise ValueError('property %s depends on unknown param %s' % (name, e))
+        except TypeError:
+            return fun(params)
+        if k not in self.property_values:
+            self.property_values[k] = fun(params)
+        return self.property_values[k]
+
     def _dict(self, props):
         params = {}
         for name, p in self.params.items():
@@ -267,52 +933,68 @@ class ExperimentConfig(Experiment):
             yield 's_' + name, p.svalue()
             params[name] = p.current
         d = self.output_dir
-        if not os.path.exists(d):
-            makedirs(d)
+        self._makedirs(d)
         for p in self.params.values():
             d = os.path.join(d, self._param_dirname(p))
-            if not os.path.exists(d):
-                makedirs(d)
+            self._makedirs(d)
             yield 'd_' + p.name, d
         if props:
             for name, fun in self.properties.items():
                 if hasattr(fun, '__call__'):
-                    yield name, fun(params)
+                    yield name, self._property_value(name, fun, params)
                 else:
                     yield name, fun
 
     def _executor(self):
-        if self.executor is not None:
-            return self.executor
-        if QSyncExecutor.ready(self):
-            log('everything in place to use qsync')
-            return QSyncExecutor
-        log('defaulting to local executor')
-        return LocalExecutor
+        if self.executor is None:
+            if QSyncExecutor.ready(self):
+                log('everything in place to use qsync')
+                return QSyncExecutor
+            log('defaulting to local executor')
+            self.executor = LocalExecutor
+        if self.executor is LocalExecutor and self.jobs > 1:
+            log('running at most %d cells in parallel' % self.jobs)
+            return ParallelLocalExecutor
+        return self.executor
 
     def pre(self):
+        if self.dry_run:
+            log('(dry run) %d cells' % self.count_cells())
         self.executor = self._executor()
         self.executor.check(self)
+        self._open_state()
+        self._open_cache()
         self.executor.pre(self)
 
     def post(self):
         self.executor.post(self)
+        if self.state is not None:
+            self.state.close()
 
     def test_exe(self, d):
         if not self.update:
             return True
+        if self.state is not None:
+            status = self.state.status(self.cell_key(), self._cell_signature(d))
+            if status == 'done':
+                log('(update) cell done, skip')
+                return False
+            if status is not None:
+                log('(update) cell %s, run again' % status)
+                return True
         if self.out is None:
             return True
         expanded = ExperimentConfig.expand(d, self.out)
-        return not os.path.exists(expanded)
+        if os.path.exists(expanded):
+            log('(update) output file exists, skip')
+            return False
+        return True
 
     def exe(self):
         d = dict(self._dict(True))
         if self.test_exe(d):
             self.executor.exe(self, d)
-        else:
-            log('(update) output file exists, skip')
-            
+
 
     def insert_param_dir(self, name):
         self.params = self._sub_params_to(name)
@@ -371,26 +1053,40 @@ class LocalExecutor:
 
     @staticmethod
     def exe(config, d):
-        out = ExperimentConfig._open_out(config.out, d)
-        err = ExperimentConfig._open_out(config.err, d)
         if config.cl is not None:
             cl = ExperimentConfig.expand(d, config.cl)
             if config.dry_run:
                 log('(dry run) ' + cl)
+                return
+            hit, entry = config._cache_fetch(d, cl)
+            if hit:
+                log('(cache) outputs fetched from cache')
+                return
+            out = ExperimentConfig._open_out(config.out, d)
+            err = ExperimentConfig._open_out(config.err, d)
+            config._delete_output_files(d)
+            key = config._record_start(d)
+            p = subprocess.Popen(cl, shell=True, executable=config.shell, stdout=out, stderr=err, close_fds=True)
+            usage = wait_usage(p)
+            config._record_end(key, p.returncode, usage)
+            if p.returncode != 0:
+                log('process has FAILED')
             else:
-                config._delete_output_files(d)
-                p = subprocess.Popen(cl, shell=True, executable=config.shell, stdout=out, stderr=err, close_fds=True)
-                p.wait()
-                if p.returncode != 0:
-                    log('process has FAILED')
+                config._cache_store(entry)
         else:
+            out = ExperimentConfig._open_out(config.out, d)
+            err = ExperimentConfig._open_out(config.err, d)
             if config.dry_run:
                 log('(dry run)' )
             else:
                 config._delete_output_files(d)
+                key = config._record_start(d)
+                before = self_usage()
                 try:
                     config.fun(tuple(config.params), d, out, err)
+                    config._record_end(key, 0, self_usage(before))
                 except:
+                    config._record_end(key, 1, self_usage(before))
                     log('function has FAILED')
                     traceback.print_exc()
                     
@@ -425,6 +1121,115 @@ class LocalExecutor:
             return ValueError('both post command line and post function specified')
         if config.output_dir is None:
             raise ValueError('no output directory specified')
+        if config.jobs < 1:
+            raise ValueError('illegal number of parallel jobs: %d' % config.jobs)
+
+
+_cell_fun = None
+
+def _init_fun_worker(fun):
+    global _cell_fun
+    _cell_fun = fun
+
+def _run_fun_cell(params, d, out_filename, err_filename):
+    out = ExperimentConfig._open_out(out_filename, d)
+    err = ExperimentConfig._open_out(err_filename, d)
+    before = self_usage()
+    try:
+        _cell_fun(params, d, out, err)
+        return None, self_usage(before)
+    except:
+        return traceback.format_exc(), self_usage(before)
+    finally:
+        for f in (out, err):
+            if f is not None:
+                f.close()
+
+
+class ParallelLocalExecutor:
+    @staticmethod
+    def pre(config):
+        LocalExecutor.pre(config)
+        config.running = []
+        config.pool = None
+        if config.fun is not None and not config.dry_run:
+            # fork so that functions defined in experiment files need not be picklable
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = None
+            config.pool = ProcessPoolExecutor(max_workers=config.jobs, mp_context=context, initializer=_init_fun_worker, initargs=(config.fun,))
+
+    @staticmethod
+    def post(config):
+        while config.running:
+            ParallelLocalExecutor._wait_one(config)
+        if config.pool is not None:
+            config.pool.shutdown()
+            config.pool = None
+        LocalExecutor.post(config)
+
+    @staticmethod
+    def exe(config, d):
+        if config.dry_run:
+            LocalExecutor.exe(config, d)
+            return
+        while len(config.running) >= config.jobs:
+            ParallelLocalExecutor._wait_one(config)
+        if config.cl is None:
+            config._delete_output_files(d)
+            key = config._record_start(d)
+            future = config.pool.submit(_run_fun_cell, tuple(config.params), d, config.out, config.err)
+            config.running.append((future, config.cell_label(), key, None))
+            return
+        cl = ExperimentConfig.expand(d, config.cl)
+        hit, entry = config._cache_fetch(d, cl)
+        if hit:
+            log('(cache) outputs fetched from cache')
+            return
+        out = ExperimentConfig._open_out(config.out, d)
+        err = ExperimentConfig._open_out(config.err, d)
+        config._delete_output_files(d)
+        key = config._record_start(d)
+        p = subprocess.Popen(cl, shell=True, executable=config.shell, stdout=out, stderr=err, close_fds=True)
+        for f in (out, err):
+            if f is not None:
+                f.close()
+        config.running.append((p, config.cell_label(), key, entry))
+
+    @staticmethod
+    def _wait_one(config):
+        if config.pool is not None:
+            done, _ = wait([f for (f, _, _, _) in config.running], return_when=FIRST_COMPLETED)
+            for i, (f, label, key, _) in enumerate(config.running):
+                if f in done:
+                    del config.running[i]
+                    try:
+                        tb, usage = f.result()
+                    except BaseException:
+                        tb, usage = traceback.format_exc(), None
+                    config._record_end(key, 0 if tb is None else 1, usage)
+                    if tb is not None:
+                        log('function has FAILED for ' + label)
+                        stderr.write(tb)
+                        stderr.flush()
+                    return
+        while True:
+            for i, (p, label, key, entry) in enumerate(config.running):
+                usage = wait_usage(p, False)
+                if usage is not None:
+                    del config.running[i]
+                    config._record_end(key, p.returncode, usage)
+                    if p.returncode != 0:
+                        log('process has FAILED for ' + label)
+                    else:
+                        config._cache_store(entry)
+                    return
+            time.sleep(0.05)
+
+    @staticmethod
+    def check(config):
+        LocalExecutor.check(config)
 
 
 
@@ -432,32 +1237,144 @@ class QSyncExecutor:
     @staticmethod
     def pre(config):
         LocalExecutor.pre(config)
+        config._makedirs(config.output_dir)
         config.qsync_filepath = os.path.join(config.output_dir, config.qsync_filename)
         config.qsync_file = open(config.qsync_filepath, 'w')
+        config.cell_groups = OrderedDict()
+        config.qsync_cells = []
+        config.cell_table = None
+        if QSyncExecutor._use_table(config):
+            table_filename = CellTable.FILENAME + ('.dry-run' if config.dry_run else '')
+            config.cell_table = CellTable(os.path.abspath(os.path.join(config.output_dir, table_filename)))
+
+    @staticmethod
+    def _use_table(config):
+        return config.array_job or config.batch_size != 1
 
     @staticmethod
     def post(config):
+        if config.cell_table is not None:
+            QSyncExecutor._write_table_jobs(config)
         config.qsync_file.close()
         if config.dry_run:
             log('(dry run) skipping job submission')
         else:
             qsync = QSync()
             qsync.filenames = (config.qsync_filepath,)
-            qsync.go(**config.qsync_opts)
+            qsync.go(listener=QSyncExecutor._listener(config), **config.qsync_opts)
+            if config.cell_table is not None:
+                config.cell_table.merge_status(config.state)
         LocalExecutor.post(config)
 
     @staticmethod
     def exe(config, d):
-        config.qsync_file.write('-V -cwd')
-        QSyncExecutor._write_qsync_opt(config, d, ' ', config.job_opts)
-        QSyncExecutor._write_qsync_opt(config, d, ' -o ', config.out)
-        QSyncExecutor._write_qsync_opt(config, d, ' -e ', config.err)
-        config.qsync_file.write(' -- ')
-        config.qsync_file.write(ExperimentConfig.expand(d, config.cl))
-        config.qsync_file.write('\n')
+        if config.cell_table is not None:
+            opts = ExperimentConfig.expand(d, config.job_opts) if config.job_opts else ''
+            row = {
+                'key': config.cell_key(),
+                'signature': config._cell_signature(d),
+                'cl': ExperimentConfig.expand(d, config.cl),
+                'out': None if config.out is None else ExperimentConfig.expand(d, config.out),
+                'err': None if config.err is None else ExperimentConfig.expand(d, config.err),
+                'shell': config.shell,
+            }
+            config.cell_groups.setdefault(opts, []).append(row)
+        else:
+            config.qsync_file.write('-V -cwd')
+            QSyncExecutor._write_qsync_opt(config, d, ' ', config.job_opts)
+            QSyncExecutor._write_qsync_opt(config, d, ' -o ', config.out)
+            QSyncExecutor._write_qsync_opt(config, d, ' -e ', config.err)
+            config.qsync_file.write(' -- ')
+            config.qsync_file.write(ExperimentConfig.expand(d, config.cl))
+            config.qsync_file.write('\n')
+            config.qsync_cells.append((config.cell_key(), config._cell_signature(d)))
         if not config.dry_run:
             config._delete_output_files(d)
 
+    @staticmethod
+    def _listener(config):
+        '''Records jobs submitted one per cell in the state file, with the resource usage reported by DRMAA.'''
+        def result(jt, info):
+            if config.state is None or config.cell_table is not None:
+                return
+            key, signature = config.qsync_cells[int(jt.source.rpartition(':')[2]) - 1]
+            ru = info.resourceUsage
+            end = float(ru.get('end_time', time.time()))
+            start = float(ru.get('start_time', end - float(ru.get('ru_wallclock', 0))))
+            usage = (float(ru.get('ru_utime', 0)), float(ru.get('ru_stime', 0)), int(float(ru.get('ru_maxrss', 0))))
+            if info.hasExited:
+                exit_code = info.exitStatus
+            elif info.hasSignal:
+                exit_code = 128 + QSyncExecutor._signal_number(info.terminatedSignal)
+            else:
+                exit_code = -1
+            config.state.start(key, signature, start)
+            config.state.end(key, exit_code, end, usage)
+        return result
+
+    @staticmethod
+    def _signal_number(name):
+        '''DRMAA reports signals by name, returns the number or 0 if the signal is unknown on this system.'''
+        try:
+            return int(name)
+        except ValueError:
+            pass
+        try:
+            return signal.Signals[name].value
+        except KeyError:
+            return 0
+
+    @staticmethod
+    def _batch_size(config):
+        if config.batch_size != 'auto':
+            if config.batch_size < 1:
+                raise ValueError('illegal batch size: %d' % config.batch_size)
+            return config.batch_size
+        durations = []
+        if config.state is not None:
+            durations = sorted(r.duration for r in config.state.records.values() if r.exit_code == 0)
+        if len(durations) == 0:
+            log('no previous timings, one cell per batch')
+            return 1
+        median = max(durations[len(durations) // 2], 0.001)
+        return max(1, int(config.batch_duration / median))
+
+    @staticmethod
+    def _write_table_jobs(config):
+        '''Writes the cell table and either one array job per distinct job options, or one job per batch.'''
+        batch_size = QSyncExecutor._batch_size(config)
+        groups = []
+        for opts, rows in config.cell_groups.items():
+            groups.append((opts, [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]))
+        state = None if config.dry_run else config.state
+        config.cell_table.write((batch for (_, batches) in groups for batch in batches), state)
+        runner = [sys.executable, os.path.abspath(__file__), '--run-cells', config.cell_table.filename]
+        if config.jobs > 1:
+            runner.extend(('--jobs', str(config.jobs)))
+        runner = ' '.join(shlex.quote(a) for a in runner)
+        first = 1
+        for opts, batches in groups:
+            last = first + len(batches) - 1
+            log('%d cells in %d %s of at most %d cells' % (sum(len(b) for b in batches), len(batches), 'tasks' if config.array_job else 'jobs', batch_size))
+            if config.array_job:
+                QSyncExecutor._write_runner(config, opts, ' -t %d-%d' % (first, last), runner)
+            else:
+                for task_id in range(first, last + 1):
+                    QSyncExecutor._write_runner(config, opts, '', '%s --task-id %d' % (runner, task_id))
+            first = last + 1
+
+    @staticmethod
+    def _write_runner(config, opts, task_range, runner):
+        config.qsync_file.write('-V -cwd')
+        if opts:
+            config.qsync_file.write(' ' + opts)
+        config.qsync_file.write(task_range)
+        if config.out is not None:
+            config.qsync_file.write(' -o /dev/null')
+        if config.err is not None:
+            config.qsync_file.write(' -e /dev/null')
+        config.qsync_file.write(' -- ' + runner + '\n')
+
     @staticmethod
     def _write_qsync_opt(config, d, prefix, suffix):
         if suffix:
@@ -474,6 +1391,9 @@ class QSyncExecutor:
         if QSync is None:
             log('qsync not imported')
             return False
+        if not backend_available(config.qsync_opts.get('backend')):
+            log('no DRMAA library, use qsync_opts(backend=\'local:N\') to run jobs on this host')
+            return False
         return True
 
     @staticmethod
@@ -486,19 +1406,35 @@ class QSyncExecutor:
 class GridXP(ArgumentParser):
     def __init__(self):
         ArgumentParser.__init__(self, description='Perform a grid experiment', epilog='For detailed documentation on experiment definition, see https://github.com/Bibliome/misc-utils/edit/master/gridxp.md')
-        self.add_argument('xp_filenames', metavar='XPFILE', type=str, nargs='+', default=[], help='file containing the experiment definition object')
+        self.add_argument('xp_filenames', metavar='XPFILE', type=str, nargs='*', default=[], help='file containing the experiment definition object')
         self.add_argument('--test', dest='test', action='store_true', default=False, help='test run, launch only one parameter value set and exit')
         self.add_argument('--load-path', metavar='PATH', dest='load_paths', action='append', type=str, default=['.'], help='add PATH to the search paths for experiments files; this option can be specified several times')
         self.add_argument('--local', dest='local', action='store_true', default=False, help='force local execution, do not submit jobs to the Grid Engine')
+        self.add_argument('--jobs', metavar='N', dest='jobs', action='store', type=int, default=None, help='when executing locally, run at most N cells in parallel')
         self.add_argument('--dry-run', dest='dry_run', action='store_true', default=False, help='do not actually run commands, just print them; if using a GE, then generates a specification file for qsync.py but do not submit jobs')
-        self.add_argument('--update', dest='update', action='store_true', default=False, help='only execute each command if the corresponding output file does not exist')
+        self.add_argument('--update', dest='update', action='store_true', default=False, help='only execute cells that have not completed successfully with the same command, according to the state file or, for unrecorded cells, to the existence of the output file')
+        self.add_argument('--cache', metavar='DIR', dest='cache_dir', action='store', type=str, default=None, help='fetch outputs of command lines already executed from the result cache in DIR, and store new outputs in it')
+        self.add_argument('--cache-size', metavar='SIZE', dest='cache_size', action='store', type=str, default=None, help='evict least recently used entries when the result cache exceeds SIZE bytes (suffixes K, M, G and T are accepted)')
         self.add_argument('--delete-out', dest='delo', action='store_true', default=False, help='delete output and error files before running (will not delete if dry run or updating).')
         self.add_argument('--param-values', metavar=('NAME', 'VALUES'), dest='param_values', nargs=2, action='append', type=str, default=[], help='set the values of parameter PARAM; VALUES must be a valid Python expression that returns a collection')
         self.add_argument('--insert-param-dir', metavar='PARAM', action='store', type=str, dest='insert_param_dir', default=None, help='insert parameter directory for PARAM in existing directory structure, instead of running the experiment')
         self.add_argument('--list-params', action='store_true', dest='list_params', default=False, help='list parameters, instead of running the experiment')
+        self.add_argument('--array-job', action='store_true', dest='array_job', default=False, help='when executing on a Grid Engine, submit a single array job instead of one job per cell')
+        self.add_argument('--report', action='store_true', dest='report', default=False, help='summarize durations, resource usage and failures recorded in the state file by parameter value, instead of running the experiment')
+        self.add_argument('--longest-first', action='store_true', dest='longest_first', default=False, help='execute or submit cells in decreasing order of their predicted duration, according to the state file')
+        self.add_argument('--batch', metavar='K', action='store', type=str, dest='batch_size', default=None, help='when executing on a Grid Engine, run K consecutive cells in each job or task; \'auto\' chooses K from the durations recorded in the state file')
+        self.add_argument('--run-cells', metavar='TABLE', action='store', type=str, dest='run_cells', default=None, help='execute the cells of an array job task listed in TABLE, instead of running an experiment (used internally)')
+        self.add_argument('--task-id', metavar='N', action='store', type=int, dest='task_id', default=None, help='task index for --run-cells (default: SGE_TASK_ID)')
 
     def go(self):
         args = self.parse_args()
+        if args.run_cells is not None:
+            task_id = args.task_id
+            if task_id is None:
+                task_id = int(os.environ['SGE_TASK_ID'])
+            exit(run_cells(args.run_cells, task_id, 1 if args.jobs is None else args.jobs))
+        if len(args.xp_filenames) == 0:
+            self.error('no experiment file')
         global LOAD_PATHS
         LOAD_PATHS = args.load_paths
         xp = ExperimentConfig()
@@ -508,19 +1444,50 @@ class GridXP(ArgumentParser):
             xp.load_config(fn)
         if args.local:
             xp.local_execution()
+        if args.jobs is not None:
+            xp.jobs = args.jobs
         for name, svalues in args.param_values:
             xp.set_param_values(name, eval(svalues))
         if args.delo:
             xp.delete_out = True
+        if args.array_job:
+            xp.array_job = True
+        if args.longest_first:
+            xp.longest_first = True
+        if args.batch_size is not None:
+            xp.batch_size = args.batch_size if args.batch_size == 'auto' else int(args.batch_size)
+        if args.cache_dir is not None:
+            xp.cache_dir = args.cache_dir
+        if args.cache_size is not None:
+            xp.cache_size = args.cache_size
         if args.insert_param_dir is not None:
             if args.list_params:
                 raise Exception('--insert-param-dir and --list-params are mutually exclusive')
             xp.insert_param_dir(args.insert_param_dir)
+        elif args.report:
+            xp.report(stdout)
         elif args.list_params:
             for p in xp.params.values():
                 stdout.write('%s\n' % p.name)
                 for v in p.values:
                     stdout.write('  %s\n' % p.order_fmt % v)
+            try:
+                stdout.write('%d cells\n' % xp.count_cells())
+            except ValueError as e:
+                stdout.write('cannot count cells: %s\n' % e)
+                return
+            if xp._state_filepath() is None:
+                stdout.write('no state file\n')
+                return
+            prediction = xp.predict()
+            if prediction is None:
+                stdout.write('no previous timings\n')
+            else:
+                total, longest, makespan = prediction
+                stdout.write('predicted total time: %.1fs\n' % total)
+                stdout.write('predicted critical path: %.1fs\n' % longest)
+                if xp.jobs > 1:
+                    stdout.write('predicted time with %d parallel cells: %.1fs\n' % (xp.jobs, makespan))
         else:
             xp.run(test=args.test)
 
@@ -1,11 +1,47 @@
 #!/usr/bin/env python
 
-import drmaa
 import shlex
+import re
+import itertools
+import math
+import heapq
+import statistics
+from collections import deque
+import os
+import signal
+import subprocess
+import time
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionParser
 from sys import stderr, stdin, exit
 from datetime import datetime
 import traceback
+try:
+    import drmaa
+except ImportError:
+    drmaa = None
+
+
+if drmaa is not None:
+    DrmaaException = drmaa.errors.DrmaaException
+    ExitTimeoutException = drmaa.errors.ExitTimeoutException
+    InvalidJobException = drmaa.errors.InvalidJobException
+    TERMINATE = drmaa.JobControlAction.TERMINATE
+else:
+    class DrmaaException(Exception):
+        pass
+
+    class ExitTimeoutException(DrmaaException):
+        pass
+
+    class InvalidJobException(DrmaaException):
+        pass
+
+    TERMINATE = 'terminate'
+RUNNING = 'running'
+
 
 def Stop(pool, jt, info):
     '''Job failure function that stops synchronization.'''
@@ -18,23 +54,547 @@ def Proceed(pool, jt, info):
     pool.all_done = False
     pool.failed_jobs.append(jt)
 
-def Resubmit(max_tries, fail):
+def Resubmit(max_tries, fail, rules=None, backoff=0):
     '''Job failure function factory that resubmits a failed job.
 
     :Parameters:
     max_tries: maximum number of submissions for a job.
     fail: failure function to call if the maximum number of tries has been reached.
+    rules: dictionary of resource names to factors, resource requests of a job that has exhausted a resource are scaled before resubmission, see escalate().
+    backoff: delay in seconds before the first resubmission of a job, doubled for each further resubmission.
     '''
     def resubmit_function(pool, jt, info):
         if jt.failures >= max_tries:
             fail(pool, jt, info)
         else:
-            jt.jobid = pool.session.runJob(jt)
-            pool.log('job specified at ' + jt.source + ' resubmitted with id ' + jt.jobid)
-            pool.current_jobs[jt.jobid] = jt
+            if rules:
+                escalate(pool, jt, info, rules)
+            pool.resubmit(jt, backoff * 2 ** (jt.failures - 1))
     return resubmit_function
 
 
+MEMORY_RESOURCES = ('h_vmem', 's_vmem', 'h_data', 's_data', 'h_rss', 's_rss', 'mem_free', 'virtual_free')
+TIME_RESOURCES = ('h_rt', 's_rt', 'h_cpu', 's_cpu')
+RESOURCE_USAGE = {
+    'h_rt': 'ru_wallclock',
+    's_rt': 'ru_wallclock',
+    'h_cpu': 'cpu',
+    's_cpu': 'cpu',
+}
+MEMORY_UNITS = {
+    '': 1,
+    'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3, 't': 1000 ** 4,
+    'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4,
+}
+SMALLER_UNIT = {'k': '', 'm': 'k', 'g': 'm', 't': 'g', 'K': '', 'M': 'K', 'G': 'M', 'T': 'G'}
+EXHAUSTED_RATIO = 0.9
+
+
+def parse_rule(rule):
+    '''Parses an escalation rule RESOURCE=FACTOR, returns the pair (resource, factor).'''
+    resource, eq, factor = rule.partition('=')
+    if resource not in MEMORY_RESOURCES and resource not in TIME_RESOURCES:
+        raise Exception('cannot escalate resource: %s' % resource)
+    try:
+        factor = float(factor)
+    except ValueError:
+        raise Exception('illegal escalation factor: %s' % rule)
+    if factor <= 1:
+        raise Exception('escalation factor must be greater than 1: %s' % rule)
+    return resource, factor
+
+
+def _resource_amount(resource, value):
+    '''Returns the amount of a resource request in bytes or seconds.'''
+    if resource in TIME_RESOURCES:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part or 0)
+        return seconds
+    m = re.match(r'(\d+(?:\.\d*)?)([kKmMgGtT]?)$', value)
+    if m is None:
+        raise ValueError(value)
+    return float(m.group(1)) * MEMORY_UNITS[m.group(2)]
+
+
+def _scale_value(resource, value, factor):
+    '''Scales a resource request, keeping its notation.'''
+    if resource in TIME_RESOURCES:
+        seconds = int(math.ceil(_resource_amount(resource, value) * factor))
+        if ':' in value:
+            return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+        return str(seconds)
+    unit = value.lstrip('0123456789.')
+    n = float(value[:len(value) - len(unit)]) * factor
+    if n == int(n):
+        return '%d%s' % (n, unit)
+    if unit == '':
+        return str(int(math.ceil(n)))
+    smaller = SMALLER_UNIT[unit]
+    return '%d%s' % (math.ceil(n * MEMORY_UNITS[unit] / MEMORY_UNITS[smaller]), smaller)
+
+
+def _exhausted(resource, value, info):
+    '''Either a failed job has exhausted a requested resource.
+
+    The resource usage reported by the scheduler is compared to the request; if the scheduler does not report it, a job killed by a signal is assumed to have exhausted its resources.
+    '''
+    if info is None or info.wasAborted:
+        return False
+    usage = (info.resourceUsage or {}).get(RESOURCE_USAGE.get(resource, 'maxvmem'))
+    try:
+        usage = float(usage)
+    except (TypeError, ValueError):
+        usage = 0
+    if usage > 0:
+        return usage >= EXHAUSTED_RATIO * _resource_amount(resource, value)
+    return info.hasSignal or (info.hasExited and info.exitStatus > 128)
+
+
+def escalate(pool, jt, info, rules):
+    '''Scales the resource requests in the native specification of a failed job, or of a single task of an array job, for each resource it has exhausted.
+
+    :Parameters:
+    pool: job pool, for logging
+    jt: job template or BulkTask
+    info: DRMAA JobInfo object of the failed job
+    rules: dictionary of resource names to factors
+    '''
+    spec = jt.spec if isinstance(jt, BulkTask) else jt.nativeSpecification
+    if isinstance(jt, BulkTask) and spec is None:
+        spec = jt.jt.nativeSpecification
+    changed = False
+    for resource, factor in rules.items():
+        m = re.search(r'(^|[\s,])%s=([^\s,]+)' % resource, spec)
+        if m is None:
+            continue
+        value = m.group(2)
+        try:
+            if not _exhausted(resource, value, info):
+                continue
+            scaled = _scale_value(resource, value, factor)
+        except ValueError:
+            pool.log('job specified at %s: cannot read %s=%s' % (jt.source, resource, value))
+            continue
+        spec = spec[:m.start(2)] + scaled + spec[m.end(2):]
+        pool.log('job specified at %s: %s raised from %s to %s' % (jt.source, resource, value, scaled))
+        changed = True
+    if not changed:
+        return
+    if isinstance(jt, BulkTask):
+        jt.spec = spec
+    else:
+        jt.nativeSpecification = spec
+
+
+def read_journal(filename):
+    '''Reads a journal written by JobPool.
+
+    :Return value:
+    a pair (contact, sources): the DRMAA session contact string, and a dictionary that maps each job source to its last event and job id.
+    '''
+    contact = None
+    sources = {}
+    with open(filename) as f:
+        for line in f:
+            cols = line.rstrip('\n').split('\t')
+            if cols[0] == 'session' and len(cols) == 2:
+                contact = cols[1]
+            elif cols[0] in ('submit', 'done', 'failed') and len(cols) == 3:
+                sources[cols[1]] = (cols[0], cols[2])
+    return contact, sources
+
+
+class LocalJobTemplate:
+    '''Job template of a LocalSession, with the same members as a DRMAA job template.'''
+    def __init__(self):
+        self.remoteCommand = None
+        self.args = []
+        self.nativeSpecification = ''
+        self.jobEnvironment = {}
+        self.workingDirectory = None
+        self.outputPath = None
+        self.errorPath = None
+        self.joinFiles = False
+        self.jobName = None
+
+
+class LocalJobInfo:
+    '''Information about a finished job of a LocalSession, with the same members as a DRMAA JobInfo.'''
+    def __init__(self, jobId, returncode, usage, aborted=False):
+        self.jobId = jobId
+        self.wasAborted = aborted
+        self.hasExited = returncode is not None and returncode >= 0
+        self.exitStatus = returncode if self.hasExited else 0
+        self.hasSignal = returncode is not None and returncode < 0
+        self.terminatedSignal = signal.Signals(-returncode).name if self.hasSignal else None
+        self.hasCoreDump = False
+        self.resourceUsage = usage
+
+
+class LocalJob:
+    def __init__(self, jobid, jt, env):
+        self.jobid = jobid
+        self.jt = jt
+        self.env = env
+        self.process = None
+        self.submission_time = time.time()
+        self.start_time = None
+        self.info = None
+
+
+class LocalSession:
+    '''
+    Stand-in for a DRMAA session that runs jobs as subprocesses of this process, at most slots at a time.
+
+    The native specification understands -o, -e, -j, -cwd, -wd and -N, other options are ignored.
+    Methods can be called from several threads, as with concurrent submissions.
+
+    :Members:
+    slots: maximum number of jobs running at the same time
+    lock: lock held while queues are read or changed, and while finished jobs are reaped
+    '''
+    TIMEOUT_NO_WAIT = 0
+    TIMEOUT_WAIT_FOREVER = -1
+    JOB_IDS_SESSION_ANY = 'DRMAA_JOB_IDS_SESSION_ANY'
+    JOB_IDS_SESSION_ALL = 'DRMAA_JOB_IDS_SESSION_ALL'
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.lock = threading.RLock()
+        self.contact = None
+        self.ids = itertools.count(1)
+        self.queued = []
+        self.running = []
+        self.finished = {}
+
+    def initialize(self, contactString=None):
+        '''Starts a new session, jobs of another session cannot be reattached since they ran in another process.'''
+        if contactString is not None:
+            raise DrmaaException('cannot reconnect to local session %s' % contactString)
+        self.token = '%d-%d' % (os.getpid(), int(time.time()))
+        self.contact = 'local:%d:%s' % (self.slots, self.token)
+
+    def exit(self):
+        pass
+
+    def createJobTemplate(self):
+        return LocalJobTemplate()
+
+    def runJob(self, jt):
+        return self._enqueue(jt, 'undefined')
+
+    def runBulkJobs(self, jt, start, end, step):
+        return [self._enqueue(jt, str(index)) for index in range(start, end + 1, step)]
+
+    def _enqueue(self, jt, task_id):
+        with self.lock:
+            jobid = '%s.%d' % (self.token, next(self.ids))
+            env = dict(os.environ)
+            env.update(jt.jobEnvironment or {})
+            env['JOB_ID'] = jobid
+            env['SGE_TASK_ID'] = task_id
+            self.queued.append(LocalJob(jobid, jt, env))
+            self._schedule()
+            return jobid
+
+    @staticmethod
+    def _native_options(spec):
+        result = {}
+        tokens = shlex.split(spec or '')
+        i = 0
+        while i < len(tokens):
+            opt = tokens[i]
+            i += 1
+            if opt in ('-o', '-e', '-j', '-wd', '-N'):
+                if i < len(tokens):
+                    result[opt] = tokens[i].rpartition(':')[2] if opt in ('-o', '-e') else tokens[i]
+                    i += 1
+            elif opt == '-cwd':
+                result[opt] = True
+            elif opt.startswith('-'):
+                while i < len(tokens) and not tokens[i].startswith('-'):
+                    i += 1
+        return result
+
+    @staticmethod
+    def _open_output(path, wd, name, suffix, jobid):
+        if path is None:
+            path = wd
+        if os.path.isdir(path):
+            path = os.path.join(path, '%s.%s%s' % (name, suffix, jobid))
+        return open(os.path.expanduser(path), 'a')
+
+    def _start(self, job):
+        '''Starts a job in its own process group, a job that cannot be started finishes with exit status 127.'''
+        jt = job.jt
+        opts = LocalSession._native_options(jt.nativeSpecification)
+        wd = jt.workingDirectory or opts.get('-wd') or (os.getcwd() if '-cwd' in opts else os.path.expanduser('~'))
+        name = jt.jobName or opts.get('-N') or os.path.basename(jt.remoteCommand)
+        job.start_time = time.time()
+        out = None
+        err = None
+        try:
+            out = LocalSession._open_output(jt.outputPath or opts.get('-o'), wd, name, 'o', job.jobid)
+            if jt.joinFiles or opts.get('-j', 'n').lower().startswith('y'):
+                err = subprocess.STDOUT
+            else:
+                err = LocalSession._open_output(jt.errorPath or opts.get('-e'), wd, name, 'e', job.jobid)
+            job.process = subprocess.Popen([jt.remoteCommand] + list(jt.args), cwd=wd, env=job.env, stdout=out, stderr=err, close_fds=True, start_new_session=True)
+        except OSError as e:
+            f = out if err is subprocess.STDOUT else err
+            if f is not None:
+                f.write('%s: %s\n' % (jt.remoteCommand, e))
+            job.info = LocalJobInfo(job.jobid, 127, LocalSession._usage(job, time.time()))
+            self.finished[job.jobid] = job
+            return
+        finally:
+            for f in (out, err):
+                if f is not None and f is not subprocess.STDOUT:
+                    f.close()
+        self.running.append(job)
+
+    @staticmethod
+    def _usage(job, end_time, ru=None):
+        result = {
+            'submission_time': str(job.submission_time),
+            'start_time': str(job.start_time),
+            'end_time': str(end_time),
+            'ru_wallclock': str(end_time - job.start_time),
+        }
+        if ru is not None:
+            result['ru_utime'] = str(ru.ru_utime)
+            result['ru_stime'] = str(ru.ru_stime)
+            result['ru_maxrss'] = str(ru.ru_maxrss)
+        return result
+
+    def _schedule(self):
+        with self.lock:
+            self._update()
+
+    def _update(self):
+        for job in list(self.running):
+            pid, status, ru = os.wait4(job.process.pid, os.WNOHANG)
+            if pid == 0:
+                continue
+            job.process.returncode = os.waitstatus_to_exitcode(status)
+            job.info = LocalJobInfo(job.jobid, job.process.returncode, LocalSession._usage(job, time.time(), ru))
+            self.running.remove(job)
+            self.finished[job.jobid] = job
+        while self.queued and len(self.running) < self.slots:
+            self._start(self.queued.pop(0))
+
+    def jobStatus(self, jobid):
+        with self.lock:
+            if any(job.jobid == jobid for job in self.queued):
+                return 'queued_active'
+            if any(job.jobid == jobid for job in self.running):
+                return 'running'
+            if jobid in self.finished:
+                return 'done'
+        raise InvalidJobException(jobid)
+
+    def wait(self, jobid, timeout=-1):
+        start = time.time()
+        while True:
+            with self.lock:
+                self._update()
+                if jobid == LocalSession.JOB_IDS_SESSION_ANY:
+                    if self.finished:
+                        return self.finished.pop(next(iter(self.finished))).info
+                    if not self.queued and not self.running:
+                        raise InvalidJobException('no job in session')
+                elif jobid in self.finished:
+                    return self.finished.pop(jobid).info
+                else:
+                    self.jobStatus(jobid)
+            if timeout != LocalSession.TIMEOUT_WAIT_FOREVER and time.time() - start >= timeout:
+                raise ExitTimeoutException()
+            time.sleep(0.05)
+
+    def control(self, jobid, action):
+        with self.lock:
+            for job in list(self.queued):
+                if jobid in (LocalSession.JOB_IDS_SESSION_ALL, job.jobid):
+                    self.queued.remove(job)
+                    job.info = LocalJobInfo(job.jobid, None, {}, aborted=True)
+                    self.finished[job.jobid] = job
+            for job in self.running:
+                if jobid in (LocalSession.JOB_IDS_SESSION_ALL, job.jobid):
+                    try:
+                        os.killpg(job.process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+
+
+def backend_available(backend=None):
+    '''Returns either the specified session backend can be used.'''
+    return drmaa is not None or (backend is not None and backend.startswith('local'))
+
+
+def create_session(backend=None):
+    '''Creates a session for the specified backend: 'drmaa' (default), 'local:N' to run at most N jobs at a time on this host, or 'local' for one job per processor.'''
+    if backend is None or backend == 'drmaa':
+        if drmaa is None:
+            raise Exception('drmaa library not available, use a local backend')
+        return drmaa.Session()
+    name, _, slots = backend.partition(':')
+    if name == 'local':
+        slots = int(slots) if slots else os.cpu_count()
+        if slots < 1:
+            raise Exception('illegal number of slots: %d' % slots)
+        return LocalSession(slots)
+    raise Exception('unknown backend: %s' % backend)
+
+
+class Histogram:
+    '''
+    Cumulative histogram of durations in seconds.
+
+    :Members:
+    buckets: upper bounds of the buckets
+    counts: number of observations in each bucket, the last one counts observations above all bounds
+    sum: sum of observations
+    count: number of observations
+    '''
+    BUCKETS = (0.1, 1, 10, 60, 300, 900, 3600, 4 * 3600, 12 * 3600, 24 * 3600)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        '''Returns a list of pairs (bound, number of observations up to bound), the last bound is '+Inf'.'''
+        result = []
+        n = 0
+        for bound, c in zip(self.buckets + ('+Inf',), self.counts):
+            n += c
+            result.append((str(bound), n))
+        return result
+
+
+class Metrics:
+    '''
+    Counters and histograms of a JobPool, periodically written to a file.
+
+    The file is written in the Prometheus text format if its name ends with .prom, in JSON otherwise.
+    It is replaced atomically, so readers never see a partial snapshot.
+
+    :Members:
+    filename: file where snapshots are written, None to only keep metrics in memory
+    period: minimum number of seconds between two snapshots
+    counters: dictionary of counter names to values
+    histograms: dictionary of histogram names to Histogram objects
+    '''
+    COUNTERS = ('submitted', 'resubmitted', 'speculated', 'done', 'failed', 'cancelled')
+    HISTOGRAMS = ('submit_latency', 'queue_wait', 'run_time')
+
+    def __init__(self, filename=None, period=10):
+        self.filename = filename
+        self.period = period
+        self.counters = dict((name, 0) for name in Metrics.COUNTERS)
+        self.histograms = dict((name, Histogram()) for name in Metrics.HISTOGRAMS)
+        self.lock = threading.Lock()
+        self.last_write = None
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    def finished(self, info):
+        '''Records the queue wait and run times of a finished job from the DRMAA resource usage.'''
+        ru = getattr(info, 'resourceUsage', None) or {}
+        try:
+            submission = float(ru['submission_time'])
+            start = float(ru['start_time'])
+            end = float(ru['end_time'])
+        except (KeyError, ValueError):
+            return
+        if start > 0:
+            if submission > 0:
+                self.observe('queue_wait', max(start - submission, 0))
+            if end > 0:
+                self.observe('run_time', max(end - start, 0))
+
+    def gauges(self, pool):
+        return {
+            'active': len(pool.current_jobs),
+            'held': pool.held,
+        }
+
+    def write(self, pool, force=True):
+        '''Writes a snapshot of the metrics, unless the last one is more recent than period seconds and force is False.'''
+        if self.filename is None:
+            return
+        now = time.time()
+        if not force and self.last_write is not None and now - self.last_write < self.period:
+            return
+        self.last_write = now
+        gauges = self.gauges(pool)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            if self.filename.endswith('.prom'):
+                self._write_prometheus(f, gauges)
+            else:
+                self._write_json(f, gauges, now)
+        os.replace(tmp, self.filename)
+
+    def _write_json(self, f, gauges, now):
+        histograms = {}
+        with self.lock:
+            for name, h in self.histograms.items():
+                histograms[name] = {'buckets': dict(h.cumulative()), 'sum': h.sum, 'count': h.count}
+        json.dump({'time': now, 'counters': self.counters, 'gauges': gauges, 'histograms': histograms}, f, indent=1)
+        f.write('\n')
+
+    def _write_prometheus(self, f, gauges):
+        for name, value in self.counters.items():
+            f.write('# TYPE qsync_jobs_%s_total counter\n' % name)
+            f.write('qsync_jobs_%s_total %d\n' % (name, value))
+        for name, value in gauges.items():
+            f.write('# TYPE qsync_jobs_%s gauge\n' % name)
+            f.write('qsync_jobs_%s %d\n' % (name, value))
+        with self.lock:
+            for name, h in self.histograms.items():
+                f.write('# TYPE qsync_%s_seconds histogram\n' % name)
+                for bound, n in h.cumulative():
+                    f.write('qsync_%s_seconds_bucket{le="%s"} %d\n' % (name, bound, n))
+                f.write('qsync_%s_seconds_sum %f\n' % (name, h.sum))
+                f.write('qsync_%s_seconds_count %d\n' % (name, h.count))
+
+
+class BulkTask:
+    '''
+    A task of an array job, tracked and resubmitted individually.
+
+    :Members:
+    jt: job template of the array job
+    index: task index
+    source: where the array job was specified, followed by the task index
+    spec: native specification of this task if it differs from the array job, see escalate()
+    '''
+    def __init__(self, jt, index, jobid):
+        self.jt = jt
+        self.index = index
+        self.source = '%s[%d]' % (jt.source, index)
+        self.jobid = jobid
+        self.failures = 0
+        self.spec = None
+
+
 class JobPool:
     '''
     A pool of jobs.
@@ -45,10 +605,43 @@ class JobPool:
     current_jobs: jobs that have been submitted and that are not finished
     all_done: either all finished jobs were successful
     shall_stop: either this object should stop the synchronization
+    listener: function called when a job is finished, with the job template and the DRMAA JobInfo object
+    pending: iterator of job templates not yet submitted
+    max_pending: maximum number of submitted jobs that are not finished, None for no limit
+    submitter: thread pool for concurrent submissions, None to submit jobs one at a time
+    journal: file where submissions and completions are appended, None for no journal
+    resumed: dictionary of job sources to their last event and job id in a previous journal, see read_journal()
+    named: dictionary of job names to job templates
+    ready: job templates whose dependencies are done, submitted before pending jobs
+    held: number of job templates waiting for dependencies
+    delayed: heap of (time, sequence number, job) of failed jobs to resubmit later
+    resubmissions: number of resubmissions, immediate or delayed
+    metrics: Metrics object
+    speculate: factor of the median run time above which idempotent jobs get a speculative copy, None to disable speculation
+    run_times: run times of successful jobs, when speculating
+    running_since: dictionary of job ids to the time they were first seen running, when speculating
+    copies: dictionary of jobs with a speculative copy to the list of job ids of their running copies
     '''
-    def __init__(self, session, logfile):
+    def __init__(self, session, logfile, listener=None, journal=None, resumed=None, metrics=None):
         self.session = session
+        self.metrics = Metrics() if metrics is None else metrics
         self.logfile = logfile
+        self.listener = listener
+        self.journal = journal
+        self.resumed = resumed
+        self.pending = None
+        self.max_pending = None
+        self.submitter = None
+        self.named = {}
+        self.ready = deque()
+        self.held = 0
+        self.delayed = []
+        self.resubmissions = 0
+        self.speculate = None
+        self.run_times = []
+        self.running_since = {}
+        self.copies = {}
+        self.last_speculation = 0
         self.current_jobs = {}
         self.all_done = True
         self.shall_stop = False
@@ -60,149 +653,622 @@ class JobPool:
         self.logfile.write('[' + d.strftime('%Y-%m-%d %H:%M:%S') + '] ' + msg + '\n')
         self.logfile.flush()
 
+    def _journal(self, event, source, jobid):
+        if self.journal is not None:
+            self.journal.write('%s\t%s\t%s\n' % (event, source, jobid))
+            self.journal.flush()
+
+    def _alive(self, jobid):
+        try:
+            self.session.jobStatus(jobid)
+            return True
+        except InvalidJobException:
+            return False
+
+    def _resume(self, jt):
+        '''Skips or reattaches a job according to the resumed journal.
+
+        :Return value:
+        the job template to submit, None if there is nothing to submit
+        '''
+        if self.resumed is None:
+            return jt
+        if getattr(jt, 'bulk', None) is not None:
+            start, end, step = jt.bulk
+            remaining = []
+            for index in range(start, end + 1, step):
+                task = BulkTask(jt, index, None)
+                if not self._resume_source(task):
+                    remaining.append(task)
+            if len(remaining) == (end - start) // step + 1:
+                return jt
+            for task in remaining:
+                self.resubmit(task)
+            return None
+        jt.failures = 0
+        if self._resume_source(jt):
+            return None
+        return jt
+
+    def _resume_source(self, jt):
+        if jt.source not in self.resumed:
+            return False
+        event, jobid = self.resumed[jt.source]
+        if event == 'done':
+            self.log('job specified at %s already done with id %s' % (jt.source, jobid))
+            self._unit_done(jt)
+            return True
+        if event == 'submit' and self._alive(jobid):
+            jt.jobid = jobid
+            self.current_jobs[jobid] = jt
+            self.log('job specified at %s reattached with id %s' % (jt.source, jobid))
+            return True
+        return False
+
+    def _register(self, jt):
+        '''Registers the name and dependencies of a job template.
+
+        :Parameters:
+        jt: job template, with optional members 'name' and 'after', the list of names of jobs that must be done before this job is submitted
+
+        :Return value:
+        True if the job can be submitted now, False if it waits for dependencies or if a dependency has failed
+        '''
+        bulk = getattr(jt, 'bulk', None)
+        jt.remaining = 1 if bulk is None else (bulk[1] - bulk[0]) // bulk[2] + 1
+        jt.state = None
+        jt.waiting = 0
+        jt.dependents = []
+        name = getattr(jt, 'name', None)
+        if name is not None:
+            if name in self.named:
+                raise Exception('%s: duplicate job name %s' % (jt.source, name))
+            self.named[name] = jt
+        after = []
+        for dep in getattr(jt, 'after', ()):
+            if dep not in self.named:
+                raise Exception('%s: unknown job name %s, dependencies must be specified before' % (jt.source, dep))
+            after.append(self.named[dep])
+        for dep in after:
+            if dep.state == 'failed':
+                self._cancel(jt, dep)
+                return False
+        for dep in after:
+            if dep.state is None:
+                jt.waiting += 1
+                dep.dependents.append(jt)
+        if jt.waiting > 0:
+            self.held += 1
+            return False
+        return True
+
+    def _unit_done(self, jt):
+        '''Records that a job or an array job task is done, and releases the dependents of the job once all its tasks are done.'''
+        owner = jt.jt if isinstance(jt, BulkTask) else jt
+        owner.remaining -= 1
+        if owner.remaining > 0 or owner.state is not None:
+            return
+        owner.state = 'done'
+        for dep in owner.dependents:
+            if dep.state is None:
+                dep.waiting -= 1
+                if dep.waiting == 0:
+                    self.held -= 1
+                    self.ready.append(dep)
+
+    def _unit_failed(self, jt):
+        '''Records that a job or an array job task has definitely failed, dependents of the job are not submitted.'''
+        owner = jt.jt if isinstance(jt, BulkTask) else jt
+        if owner.state is not None:
+            return
+        owner.state = 'failed'
+        for dep in owner.dependents:
+            if dep.state is None:
+                self._cancel(dep, owner)
+
+    def _cancel(self, jt, failed):
+        if jt.waiting > 0:
+            self.held -= 1
+        jt.state = 'failed'
+        jt.jobid = None
+        self.metrics.count('cancelled')
+        self.log('job specified at %s not submitted, dependency %s failed' % (jt.source, failed.name))
+        self.all_done = False
+        self.failed_jobs.append(jt)
+        for dep in jt.dependents:
+            if dep.state is None:
+                self._cancel(dep, jt)
+
     def createJobTemplate(self):
         '''Creates a job template (delegates to self.session)'''
         return self.session.createJobTemplate()
 
-    def runJob(self, jt):
-        '''Submits a job.
+    def submit(self, jt):
+        '''Submits a job or a single array job task without tracking it, returns the job id.'''
+        t = time.time()
+        if isinstance(jt, BulkTask):
+            spec = jt.jt.nativeSpecification
+            if jt.spec is not None:
+                jt.jt.nativeSpecification = jt.spec
+            try:
+                jobid = self.session.runBulkJobs(jt.jt, jt.index, jt.index, 1)[0]
+            finally:
+                jt.jt.nativeSpecification = spec
+        else:
+            jobid = self.session.runJob(jt)
+        self.metrics.observe('submit_latency', time.time() - t)
+        return jobid
 
-        This method delegates to self.session, then keeps track of the submitted job
+    def resubmit(self, jt, delay=0):
+        '''Submits again a job that has failed, or a single task of an array job.
 
         :Parameters:
-        jt: job template, with a member 'source' indicating where this template was specified
+        jt: job template or BulkTask
+        delay: number of seconds to wait before submitting, the job is then submitted by waitall()
         '''
-        jt.jobid = self.session.runJob(jt)
+        self.resubmissions += 1
+        if delay > 0:
+            self.log('job specified at %s will be resubmitted in %g seconds' % (jt.source, delay))
+            heapq.heappush(self.delayed, (time.time() + delay, self.resubmissions, jt))
+        else:
+            self._submit_again(jt)
+
+    def _submit_again(self, jt):
+        jt.jobid = self.submit(jt)
+        self.log('job specified at ' + jt.source + ' resubmitted with id ' + jt.jobid)
+        self._journal('submit', jt.source, jt.jobid)
+        self.metrics.count('resubmitted')
+        self.current_jobs[jt.jobid] = jt
+
+    def _submit_new(self, jt):
+        '''Submits a job template without tracking it, returns the job id, or the list of task job ids of an array job.'''
+        t = time.time()
+        if getattr(jt, 'bulk', None) is not None:
+            start, end, step = jt.bulk
+            jobid = self.session.runBulkJobs(jt, start, end, step)
+        else:
+            jobid = self.session.runJob(jt)
+        self.metrics.observe('submit_latency', time.time() - t)
+        return jobid
+
+    def _track(self, jt, jobid):
+        '''Keeps track of a job submitted with _submit_new().'''
+        if getattr(jt, 'bulk', None) is not None:
+            start, end, step = jt.bulk
+            for index, taskid in zip(range(start, end + 1, step), jobid):
+                task = BulkTask(jt, index, taskid)
+                self.current_jobs[taskid] = task
+                self._journal('submit', task.source, taskid)
+            self.metrics.count('submitted', len(jobid))
+            self.log('array job specified at %s submitted with %d tasks, ids %s to %s' % (jt.source, len(jobid), jobid[0], jobid[-1]))
+            return
+        jt.jobid = jobid
         if jt.source is None:
             jt.source = jobid
         jt.failures = 0
         self.log('job specified at ' + jt.source + ' submitted with id ' + jt.jobid)
+        self._journal('submit', jt.source, jt.jobid)
+        self.metrics.count('submitted')
         self.current_jobs[jt.jobid] = jt
-        return jt.jobid
+
+    def runJob(self, jt):
+        '''Submits a job.
+
+        This method delegates to self.session, then keeps track of the submitted job
+
+        :Parameters:
+        jt: job template, with a member 'source' indicating where this template was specified, and an optional member 'bulk' with the (start, end, step) task indexes of an array job
+
+        Dependencies are handled by runall(), this method submits the job right away.
+        '''
+        jobid = self._submit_new(jt)
+        self._track(jt, jobid)
+        return jobid
+
+    def runBulkJob(self, jt):
+        '''Submits an array job, each task is then tracked as a BulkTask.
+
+        :Parameters:
+        jt: job template, with a member 'bulk' with the (start, end, step) task indexes
+        '''
+        return self.runJob(jt)
 
     def waitall(self, fail=Proceed, interval=60):
         '''Waits for all submitted jobs to finish.
 
+        Each job is handled as soon as it finishes.
+        Between two finished jobs, the wait timeout starts at one second and doubles up to interval seconds, the status is logged every time the timeout reaches interval.
+
         :Parameters:
         fail: function called in case of failure, the function must accept 3 paremeters: this object, the JobTemplate object and the DRMAA JobInfo object.
-        interval: check for job status every number of seconds.
+        interval: maximum wait timeout in seconds.
         '''
         start = datetime.now()
-        running = 0
-        while self.current_jobs:
-            joblist = list(self.current_jobs.keys()) # create fresh list to work around Python 3 iterator
+        timeout = self.session.TIMEOUT_NO_WAIT
+        while self.current_jobs or self.delayed:
+            while self.delayed and self.delayed[0][0] <= time.time():
+                self._submit_again(heapq.heappop(self.delayed)[2])
+            if not self.current_jobs:
+                if self.delayed:
+                    time.sleep(max(0, self.delayed[0][0] - time.time()))
+                continue
+            wait = timeout
+            if self.delayed:
+                wait = min(timeout, max(int(math.ceil(self.delayed[0][0] - time.time())), 1))
             try:
-                self.log('synchronizing %d jobs (%d running), see you in %d seconds' % (len(joblist), running, interval))
-                self.session.synchronize(joblist, interval, False)
-            except drmaa.errors.ExitTimeoutException:
-                pass
-            running = 0
-            for jobid in joblist:
-                status = self.session.jobStatus(jobid)
-                if status == drmaa.JobState.DONE:
-                    try:
-                        info = self.session.wait(jobid, drmaa.Session.TIMEOUT_NO_WAIT)
-                        jt = self.current_jobs[jobid]
-                    except drmaa.errors.ExitTimeoutException:
-                        pass
-                    if info.wasAborted:
-                        self.log('job specified at %s with id %s aborted' % (self.current_jobs[jobid].source, jobid))
-                        self._failed(jobid, fail, info)
-                    elif info.hasSignal:
-                        self.log('job specified at %s with id %s aborted received signal %d' % (self.current_jobs[jobid].source, jobid, info.terminatedSignal))
-                        self._failed(jobid, fail, info)
-                    elif info.exitStatus != 0:
-                        self.log('job specified at %s with id %s aborted exited with status %d' % (self.current_jobs[jobid].source, jobid, info.exitStatus))
-                        self._failed(jobid, fail, info)
-                    else:
-                        self.log('job specified at %s with id %s is done' % (self.current_jobs[jobid].source, jobid))
-                        del self.current_jobs[jobid]
-                elif status == drmaa.JobState.FAILED:
-                    self.log('job specified at %s with id %s failed somehow' % (self.current_jobs[jobid].source, jobid))
+                info = self.session.wait(self.session.JOB_IDS_SESSION_ANY, wait)
+            except ExitTimeoutException:
+                if timeout >= interval:
+                    self.log('waiting for %d jobs' % len(self.current_jobs))
+                timeout = min(max(2 * timeout, 1), interval)
+                self._speculate(interval)
+                self.metrics.write(self, False)
+                continue
+            except InvalidJobException:
+                self.log('no more jobs in session, %d jobs lost' % len(self.current_jobs))
+                for jobid in list(self.current_jobs.keys()):
                     self._failed(jobid, fail, None)
-                elif status == drmaa.JobState.RUNNING:
-                    running += 1
+                if not self.shall_stop:
+                    self._top_up()
+                continue
+            timeout = self.session.TIMEOUT_NO_WAIT
+            self._finished(info, fail)
             if self.shall_stop:
                 break
+            self._top_up()
+            self._speculate(interval)
+            self.metrics.write(self, False)
+        self.metrics.write(self)
         if self.all_done:
             delta = datetime.now() - start
             self.log('all jobs completed successfully in ' + str(delta) + ', you\'re welcome')
         else:
             self.log('sorry, the following jobs have failed:')
             for job in self.failed_jobs:
-                self.log(job.source + ' with id ' + str(job.jobid))
+                if job.jobid is None:
+                    self.log(job.source + ' not submitted')
+                else:
+                    self.log(job.source + ' with id ' + str(job.jobid))
+
+    def _finished(self, info, fail):
+        jobid = info.jobId
+        if jobid not in self.current_jobs:
+            return
+        jt = self.current_jobs[jobid]
+        self.metrics.finished(info)
+        if jt in self.copies and not self._first_copy(jt, info):
+            return
+        if self.listener is not None:
+            try:
+                self.listener(jt, info)
+            except Exception as e:
+                self.log('listener failed for job specified at %s with id %s: %s' % (jt.source, jobid, e))
+        if info.wasAborted:
+            self.log('job specified at %s with id %s aborted' % (jt.source, jobid))
+            self._failed(jobid, fail, info)
+        elif info.hasSignal:
+            self.log('job specified at %s with id %s aborted received signal %s' % (jt.source, jobid, info.terminatedSignal))
+            self._failed(jobid, fail, info)
+        elif info.exitStatus != 0:
+            self.log('job specified at %s with id %s aborted exited with status %d' % (jt.source, jobid, info.exitStatus))
+            self._failed(jobid, fail, info)
+        else:
+            self.log('job specified at %s with id %s is done' % (jt.source, jobid))
+            self._journal('done', jt.source, jobid)
+            self.metrics.count('done')
+            del self.current_jobs[jobid]
+            if self.speculate is not None:
+                self._record_run_time(jobid, info)
+            self._unit_done(jt)
+
+    SPECULATION_DONE_RATIO = 0.9
+    SPECULATION_MIN_SAMPLES = 10
+
+    def _record_run_time(self, jobid, info):
+        since = self.running_since.pop(jobid, None)
+        ru = info.resourceUsage or {}
+        try:
+            self.run_times.append(float(ru['end_time']) - float(ru['start_time']))
+        except (KeyError, ValueError):
+            if since is not None:
+                self.run_times.append(time.time() - since)
+
+    def _speculate(self, period):
+        '''Submits a copy of idempotent jobs that run much longer than the median, once most jobs are done.
+
+        Job status is queried at most every period seconds, and only once all jobs have been submitted.
+        '''
+        if self.speculate is None or self.pending is not None or self.ready or self.held or self.delayed:
+            return
+        done = len(self.run_times)
+        if done < JobPool.SPECULATION_MIN_SAMPLES or done < JobPool.SPECULATION_DONE_RATIO * (done + len(self.current_jobs)):
+            return
+        now = time.time()
+        if now - self.last_speculation < period:
+            return
+        self.last_speculation = now
+        limit = self.speculate * statistics.median(self.run_times)
+        for jobid, jt in list(self.current_jobs.items()):
+            if jt in self.copies:
+                continue
+            owner = jt.jt if isinstance(jt, BulkTask) else jt
+            if not getattr(owner, 'idempotent', False):
+                continue
+            if jobid not in self.running_since:
+                try:
+                    if self.session.jobStatus(jobid) == RUNNING:
+                        self.running_since[jobid] = now
+                except DrmaaException:
+                    pass
+                continue
+            elapsed = now - self.running_since[jobid]
+            if elapsed < limit:
+                continue
+            copy = self.submit(jt)
+            self.log('job specified at %s with id %s running for %ds, median is %ds, speculative copy submitted with id %s' % (jt.source, jobid, elapsed, limit / self.speculate, copy))
+            self._journal('submit', jt.source, copy)
+            self.metrics.count('speculated')
+            self.copies[jt] = [jobid, copy]
+            self.current_jobs[copy] = jt
+
+    def _first_copy(self, jt, info):
+        '''Handles a finished copy of a job with a speculative copy.
+
+        If the copy succeeded, then the other copies are terminated.
+        If it failed while another copy is still running, it is ignored.
+
+        :Return value:
+        True if this copy must be handled as the job, False if it must be ignored
+        '''
+        jobid = info.jobId
+        copies = self.copies[jt]
+        copies.remove(jobid)
+        self.running_since.pop(jobid, None)
+        if not info.wasAborted and not info.hasSignal and info.exitStatus == 0:
+            for other in copies:
+                self.log('job specified at %s with id %s finished first, terminating copy with id %s' % (jt.source, jobid, other))
+                try:
+                    self.session.control(other, TERMINATE)
+                except DrmaaException:
+                    pass
+                del self.current_jobs[other]
+                self.running_since.pop(other, None)
+        elif copies:
+            self.log('copy of job specified at %s with id %s failed, waiting for copy with id %s' % (jt.source, jobid, copies[0]))
+            del self.current_jobs[jobid]
+            return False
+        del self.copies[jt]
+        jt.jobid = jobid
+        return True
 
     def _failed(self, jobid, fail, info):
         jt = self.current_jobs[jobid]
+        self._journal('failed', jt.source, jobid)
+        self.metrics.count('failed')
         jt.failures += 1
         del self.current_jobs[jobid]
+        resubmissions = self.resubmissions
         fail(self, jt, info)
+        if self.resubmissions == resubmissions:
+            self._unit_failed(jt)
 
-    def runall(self, jobs, fail=Proceed, interval=60):
+    SUBMISSION_CHUNK = 256
+
+    def _next_jobs(self, n):
+        '''Returns at most n job templates to submit, released jobs first, then pending jobs whose dependencies are done.'''
+        chunk = []
+        while len(chunk) < n:
+            if self.ready:
+                jt = self.ready.popleft()
+            elif self.pending is not None:
+                jt = next(self.pending, None)
+                if jt is None:
+                    self.pending = None
+                    break
+                if not self._register(jt):
+                    continue
+            else:
+                break
+            jt = self._resume(jt)
+            if jt is not None:
+                chunk.append(jt)
+        return chunk
+
+    def _top_up(self):
+        '''Submits ready and pending jobs until the number of submitted jobs that are not finished reaches max_pending.
+
+        Jobs waiting for dependencies are held until their dependencies are done.
+        With a submitter, chunks of jobs are submitted concurrently, and tracked in order; if a submission fails, the other jobs of the chunk are tracked before the error is raised.
+        '''
+        while True:
+            if self.max_pending is None:
+                n = JobPool.SUBMISSION_CHUNK
+            else:
+                n = self.max_pending - len(self.current_jobs)
+            if n <= 0:
+                break
+            chunk = self._next_jobs(n)
+            if not chunk:
+                break
+            if self.submitter is None:
+                for jt in chunk:
+                    self.runJob(jt)
+            else:
+                futures = [self.submitter.submit(self._submit_new, jt) for jt in chunk]
+                error = None
+                for jt, future in zip(chunk, futures):
+                    try:
+                        self._track(jt, future.result())
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                if error is not None:
+                    raise error
+
+    def runall(self, jobs, fail=Proceed, interval=60, max_pending=None, submit_threads=1, speculate=None):
         '''Submits jobs and waits for them to finish.
 
         :Parameters:
-        jobs: a sequence of job templates
+        jobs: a sequence of job templates, a job with an 'after' member is submitted once the named jobs are done, and never if one of them fails
         fail: job failure function
-        interval: job status check interval in seconds
+        interval: maximum wait timeout in seconds
+        max_pending: maximum number of submitted jobs that are not finished, None for no limit
+        submit_threads: number of concurrent submissions, the DRMAA library must be thread-safe
+        speculate: once most jobs are done, submit a copy of idempotent jobs running for more than speculate times the median run time, None to disable
 
         :Return value:
         True if all jobs finished successfully, False otherwise.
         '''
-        for jt in jobs:
-            self.runJob(jt)
-        self.waitall(fail, interval)
+        self.pending = iter(jobs)
+        self.max_pending = max_pending
+        self.speculate = speculate
+        if submit_threads > 1:
+            self.submitter = ThreadPoolExecutor(max_workers=submit_threads)
+        try:
+            self._top_up()
+            self.waitall(fail, interval)
+        finally:
+            if self.submitter is not None:
+                self.submitter.shutdown()
+                self.submitter = None
         return self.all_done
 
     def terminate(self):
         '''Terminates all remaining jobs.'''
         self.log('terminating remaining jobs')
-        self.session.control(drmaa.Session.JOB_IDS_SESSION_ALL, drmaa.JobControlAction.TERMINATE)
+        self.session.control(self.session.JOB_IDS_SESSION_ALL, TERMINATE)
         self.current_jobs = {}
 
 
 
 
 
+class JobSpec:
+    '''
+    A parsed and validated job specification.
+
+    :Members:
+    source: where this job was specified
+    native: native specification, without the task range and job fields
+    bulk: (start, end, step) task indexes of an array job, None for a single job
+    name: job name, None if the job has no name
+    after: names of the jobs that must be done before this job
+    idempotent: either the job can safely run twice at the same time
+    command: executable
+    args: command-line arguments
+    '''
+    def __init__(self, source):
+        self.source = source
+        self.native = ''
+        self.bulk = None
+        self.name = None
+        self.after = []
+        self.idempotent = False
+        self.command = None
+        self.args = []
+
+    def template(self, session):
+        '''Creates the job template for this specification.'''
+        jt = session.createJobTemplate()
+        jt.source = self.source
+        jt.nativeSpecification = self.native
+        jt.bulk = self.bulk
+        jt.name = self.name
+        jt.after = self.after
+        jt.idempotent = self.idempotent
+        jt.remoteCommand = self.command
+        jt.args = self.args
+        return jt
+
+
 class QSyncBase:
     def __init__(self):
         pass
 
+    def parse_jobs(self):
+        '''Parses and validates all job specifications, before any job is submitted.
+
+        :Return value:
+        list of error messages, empty if all specifications are valid
+        '''
+        return []
+
     def create_jobs(self, session):
         raise NotImplemented()
 
-    def go(self, interval=60, force_interval=False, fail=Proceed, logfile=stderr):
+    def go(self, interval=60, force_interval=False, fail=Proceed, logfile=stderr, listener=None, max_pending=None, submit_threads=1, journal=None, resume=None, backend=None, metrics=None, speculate=None):
         if interval < 1:
             raise Exception('illegal interval: %d' % interval)
+        if max_pending is not None and max_pending < 1:
+            raise Exception('illegal maximum number of pending jobs: %d' % max_pending)
+        if submit_threads < 1:
+            raise Exception('illegal number of submission threads: %d' % submit_threads)
+        if speculate is not None and speculate <= 1:
+            raise Exception('illegal speculation factor: %g' % speculate)
         if interval <= 10 and not force_interval:
             raise Exception('unwise interval: %d (use force interval if you want this anyway')
-        session = drmaa.Session()
-        session.initialize()
+        errors = self.parse_jobs()
+        if errors:
+            for error in errors:
+                logfile.write(error + '\n')
+            raise Exception('%d invalid job specifications, no job submitted' % len(errors))
+        contact, resumed = None, None
+        if resume is not None:
+            contact, resumed = read_journal(resume)
+            if journal is None:
+                journal = resume
+        session = create_session(backend)
+        try:
+            session.initialize(contact)
+        except DrmaaException:
+            if contact is None:
+                raise
+            logfile.write('could not reconnect to session %s, running jobs will be submitted again\n' % contact)
+            session.initialize()
+        journal_file = None
+        if journal is not None:
+            journal_file = open(journal, 'a')
+            journal_file.write('session\t%s\n' % session.contact)
         jobs = self.create_jobs(session)
-        pool = JobPool(session, logfile)
+        pool = JobPool(session, logfile, listener, journal_file, resumed, Metrics(metrics))
         try:
-            r = pool.runall(jobs, fail, interval)
+            r = pool.runall(jobs, fail, interval, max_pending, submit_threads, speculate)
             if not r:
                 pool.terminate()
             return r
         except BaseException as e:
             pool.log('wow, some exception here...')
             traceback.print_exc()
-            pool.terminate()
+            if journal is None:
+                pool.terminate()
+            else:
+                pool.log('leaving jobs running, resume with --resume ' + journal)
         finally:
             session.exit()
+            if journal_file is not None:
+                journal_file.close()
 
 
 class QSync(OptionParser, QSyncBase):
     def __init__(self):
         OptionParser.__init__(self, usage='Usage: %prog [OPTIONS] [FILE...]')
+        self.specs = None
         self.set_defaults(fail=Proceed)
         self.add_option('-s', '--stop-on-failure', action='store_const', const=Stop, dest='fail', help='if one job fails, stop synchronization and terminate all remaining jobs')
         self.add_option('-p', '--proceed-on-failure', action='store_const', const=Proceed, dest='fail', help='continue running jobs even if some fail (default behaviour)')
         self.add_option('-r', '--resubmit-on-failure', action='store', type='int', dest='resubmit', help='resubmit failed jobs at most N times each', metavar='N')
+        self.add_option('--escalate', action='append', type='string', dest='escalate', default=[], help='before resubmitting a job that has used at least 90%% of RESOURCE, or that was killed by a signal, multiply its RESOURCE request by FACTOR (requires -r, can be specified several times)', metavar='RESOURCE=FACTOR')
+        self.add_option('--backoff', action='store', type='float', dest='backoff', default=0, help='wait T seconds before resubmitting a failed job, doubled for each further resubmission (requires -r)', metavar='T')
         self.add_option('-l', '--log-file', action='store', type='string', dest='logfile', default=None, help='write log into FILE (default: stderr)', metavar='FILE')
-        self.add_option('-i', '--interval', action='store', type='int', dest='interval', default=60, help='wait T seconds before polling job status, values below 10 require --force-interval (default: %default)', metavar='T')
+        self.add_option('-i', '--interval', action='store', type='int', dest='interval', default=60, help='wait at most T seconds for a job to finish before logging the status, values below 10 require --force-interval (default: %default)', metavar='T')
         self.add_option('--force-interval', action='store_true', dest='force_interval', default=False, help='accept poll intervals below 10 seconds')
+        self.add_option('-b', '--backend', action='store', type='string', dest='backend', default='drmaa', help='\'drmaa\' to submit jobs to the Grid Engine, \'local:N\' to run at most N jobs at a time on this host (default: %default)', metavar='BACKEND')
+        self.add_option('-j', '--journal', action='store', type='string', dest='journal', default=None, help='append job submissions and completions to FILE', metavar='FILE')
+        self.add_option('--resume', action='store', type='string', dest='resume', default=None, help='resume a previous run from its journal: reattach to running jobs, skip finished jobs and submit the others; the same job files must be specified', metavar='JOURNAL')
+        self.add_option('--submit-threads', action='store', type='int', dest='submit_threads', default=1, help='submit up to N jobs concurrently (default: %default)', metavar='N')
+        self.add_option('--speculate', action='store', type='float', dest='speculate', default=None, help='once 90%% of the jobs are done, submit a copy of idempotent jobs running for more than F times the median run time, keep the first copy to finish', metavar='F')
+        self.add_option('--metrics', action='store', type='string', dest='metrics', default=None, help='periodically write job counters and duration histograms to FILE, in Prometheus text format if FILE ends with .prom, in JSON otherwise', metavar='FILE')
+        self.add_option('-m', '--max-pending', action='store', type='int', dest='max_pending', default=None, help='keep at most N submitted jobs that are not finished, submit the following jobs as they finish', metavar='N')
 
     def run(self):
         options, self.filenames = self.parse_args()
@@ -210,36 +1276,110 @@ class QSync(OptionParser, QSyncBase):
         if options.resubmit:
             if options.resubmit < 1:
                 raise Exception('illegal number of resubmissions: %d' % options.resubmit)
-            fail = Resubmit(options.resubmit, fail)
+            rules = dict(parse_rule(rule) for rule in options.escalate)
+            fail = Resubmit(options.resubmit, fail, rules, options.backoff)
+        elif options.escalate or options.backoff:
+            raise Exception('--escalate and --backoff require --resubmit-on-failure')
         logfile = stderr
         if options.logfile:
             logfile = open(options.logfile, 'w')
-        self.go(interval=options.interval, force_interval=options.force_interval, fail=fail, logfile=logfile)
+        return self.go(interval=options.interval, force_interval=options.force_interval, fail=fail, logfile=logfile, max_pending=options.max_pending, submit_threads=options.submit_threads, journal=options.journal, resume=options.resume, backend=options.backend, metrics=options.metrics, speculate=options.speculate)
+
+    JOB_FIELD = re.compile(r'\s*(?:(name|after)=(\S+)|(idempotent))(?=\s|$)')
 
     @staticmethod
-    def _create_job(session, filename, f):
-        for n, line in enumerate(f):
-            jt = session.createJobTemplate()
-            b, dd, a = line.partition('--')
-            if dd != '':
-                jt.nativeSpecification = b
-                line = a
-            args = shlex.split(line)
-            jt.remoteCommand = args[0]
-            jt.args = args[1:]
-            jt.source = '%s:%d' % (filename, n + 1)
-            yield jt
-        
-    def create_jobs(self, session):
+    def _job_fields(spec):
+        '''Extracts the leading name=, after= and idempotent fields from the options of a job.'''
+        name, after, idempotent = None, [], False
+        m = QSync.JOB_FIELD.match(spec)
+        while m is not None:
+            if m.group(3) is not None:
+                idempotent = True
+            elif m.group(1) == 'name':
+                name = m.group(2)
+            else:
+                after.extend(dep for dep in m.group(2).split(',') if dep)
+            spec = spec[m.end():]
+            m = QSync.JOB_FIELD.match(spec)
+        return spec, name, after, idempotent
+
+    TASK_RANGE = re.compile(r'(?:^|\s)-t\s+(\d+)(?:-(\d+)(?::(\d+))?)?(?=\s|$)')
+
+    @staticmethod
+    def _task_range(spec):
+        '''Extracts the task range option from a native specification, DRMAA submits array jobs through runBulkJobs instead.'''
+        m = QSync.TASK_RANGE.search(spec)
+        if m is None:
+            if re.search(r'(?:^|\s)-t(?=\s|$)', spec):
+                raise ValueError('illegal task range, expected -t START-END[:STEP]')
+            return spec, None
+        start = int(m.group(1))
+        end = start if m.group(2) is None else int(m.group(2))
+        step = 1 if m.group(3) is None else int(m.group(3))
+        if start < 1 or end < start or step < 1:
+            raise ValueError('illegal task range: %s' % m.group().strip())
+        return spec[:m.start()] + spec[m.end():], (start, end, step)
+
+    @staticmethod
+    def _parse_job(source, line):
+        '''Parses a job specification line, raises ValueError if it is invalid.'''
+        spec = JobSpec(source)
+        b, dd, a = line.partition('--')
+        if dd != '':
+            b, spec.name, spec.after, spec.idempotent = QSync._job_fields(b)
+            spec.native, spec.bulk = QSync._task_range(b)
+            shlex.split(spec.native)
+            line = a
+        args = shlex.split(line)
+        if not args:
+            raise ValueError('missing command')
+        spec.command = args[0]
+        spec.args = args[1:]
+        return spec
+
+    def _job_files(self):
         if self.filenames:
             for filename in self.filenames:
-                f = open(filename)
-                for p in QSync._create_job(session, filename, f):
-                    yield p
-                f.close()
+                with open(filename) as f:
+                    yield filename, f
         else:
-            for p in QSync._create_job(session, '<stdin>', stdin):
-                yield p
+            yield '<stdin>', stdin
+
+    def parse_jobs(self):
+        '''Parses and validates the lines of all job files, blank lines are ignored.
+
+        Parsed specifications are kept in self.specs, job templates are created from them as jobs are submitted.
+        '''
+        self.specs = []
+        errors = []
+        names = set()
+        for filename, f in self._job_files():
+            for n, line in enumerate(f):
+                if line.isspace() or line == '':
+                    continue
+                source = '%s:%d' % (filename, n + 1)
+                try:
+                    spec = QSync._parse_job(source, line)
+                except ValueError as e:
+                    errors.append('%s: %s' % (source, e))
+                    continue
+                for dep in spec.after:
+                    if dep not in names:
+                        errors.append('%s: unknown job name %s, dependencies must be specified before' % (source, dep))
+                if spec.name is not None:
+                    if spec.name in names:
+                        errors.append('%s: duplicate job name %s' % (source, spec.name))
+                    names.add(spec.name)
+                self.specs.append(spec)
+        return errors
+
+    def create_jobs(self, session):
+        if self.specs is None:
+            errors = self.parse_jobs()
+            if errors:
+                raise Exception(errors[0])
+        for spec in self.specs:
+            yield spec.template(session)
 
 if __name__ == '__main__':
     if not QSync().run():
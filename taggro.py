@@ -1,8 +1,22 @@
 #!/usr/bin/env python
 
 from sys import stdin, stdout, stderr
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, OrderedDict, deque
 from argparse import ArgumentParser
+from functools import partial
+from array import array
+import itertools
+import heapq
+import math
+import hashlib
+import pickle
+import sys
+import tempfile
+import shutil
+import io
+import locale
+import os.path
+from concurrent.futures import ProcessPoolExecutor
 
 
 class Aggregator:
@@ -15,6 +29,14 @@ class Aggregator:
     def get_value(self, sep):
         return self.value
 
+    def get_state(self):
+        '''Returns a picklable partial state of this aggregator.'''
+        return self.value
+
+    def merge_state(self, state):
+        '''Merges a partial state of an aggregator of the same type that has seen values after the values of this aggregator.'''
+        raise NotImplementedError()
+
     @staticmethod
     def numeric_options(args):
         number_type = int
@@ -60,6 +82,30 @@ class Aggregator:
             if len(args) != 0:
                 raise ValueError('unknown aggregator option %s' % args[0])
             return Values
+        if ctor == 'distinct':
+            if len(args) == 0:
+                return Distinct
+            if args == ['approx']:
+                return ApproxDistinct
+            raise ValueError('unknown aggregator option %s' % args[-1])
+        if ctor == 'quantile':
+            if len(args) == 0:
+                raise ValueError('missing quantile, expected quantile:P')
+            p = float(args[0])
+            if p < 0 or p > 1:
+                raise ValueError('quantile must be between 0 and 1: %s' % args[0])
+            number_type, strict = Aggregator.numeric_options(args[1:])
+            return partial(Quantile, number_type, strict, p)
+        if ctor == 'median':
+            number_type, strict = Aggregator.numeric_options(args)
+            return partial(Quantile, number_type, strict, 0.5)
+        if ctor == 'topk':
+            if len(args) != 1:
+                raise ValueError('expected topk:K')
+            k = int(args[0])
+            if k < 1:
+                raise ValueError('illegal number of values: %d' % k)
+            return partial(TopK, k)
         raise ValueError('unknown aggregator %s' % ctor)
 
     @staticmethod
@@ -76,6 +122,9 @@ class Ignore(Aggregator):
     def add_value(self, value):
         pass
 
+    def merge_state(self, state):
+        pass
+
 
 class First(Aggregator):
     def __init__(self):
@@ -85,6 +134,10 @@ class First(Aggregator):
         if self.value is None:
             self.value = value
 
+    def merge_state(self, state):
+        if self.value is None:
+            self.value = state
+
 
 class Last(Aggregator):
     def __init__(self):
@@ -93,6 +146,10 @@ class Last(Aggregator):
     def add_value(self, value):
         self.value = value
 
+    def merge_state(self, state):
+        if state is not None:
+            self.value = state
+
 
 class Group(First):
     def __init__(self):
@@ -106,6 +163,9 @@ class Count(Aggregator):
     def add_value(self, value):
         self.value += 1
 
+    def merge_state(self, state):
+        self.value += state
+
 
 class NumericAggregator(Aggregator):
     def __init__(self, number_type, strict=False):
@@ -127,9 +187,14 @@ class NumericAggregator(Aggregator):
     def add_missing(self):
         raise NotImplementedError()
 
+    def merge_numbers(self, values):
+        '''Adds numbers in order, as if they were read by this aggregator.'''
+        for value in values:
+            self.add_number(value)
+
     @classmethod
     def Type(cls, number_type, strict=False):
-        return lambda: cls(number_type, strict)
+        return partial(cls, number_type, strict)
 
 
 class Sum(NumericAggregator):
@@ -142,6 +207,9 @@ class Sum(NumericAggregator):
     def add_missing(self):
         pass
 
+    def merge_state(self, state):
+        self.value += state
+
 
 class Mean(NumericAggregator):
     def __init__(self, number_type, strict=False):
@@ -158,6 +226,26 @@ class Mean(NumericAggregator):
     def get_value(self, sep):
         return float(self.value) / self.count
 
+    def get_state(self):
+        return (self.value, self.count)
+
+    def merge_state(self, state):
+        self.value += state[0]
+        self.count += state[1]
+
+
+class Numbers(NumericAggregator):
+    '''Keeps the numbers read in a column, so that float sums can be replayed in order when merging partial results.'''
+    def __init__(self, number_type, strict=False):
+        NumericAggregator.__init__(self, number_type, strict)
+        self.value = []
+
+    def add_number(self, value):
+        self.value.append(value)
+
+    def add_missing(self):
+        pass
+
 
 class Values(Aggregator):
     def __init__(self):
@@ -169,6 +257,655 @@ class Values(Aggregator):
     def get_value(self, sep):
         return sep.join(str(x) for x in self.value)
 
+    def get_state(self):
+        return list(self.value)
+
+    def merge_state(self, state):
+        for value in state:
+            self.value[value] = None
+
+
+class Distinct(Aggregator):
+    def __init__(self):
+        Aggregator.__init__(self, set())
+
+    def add_value(self, value):
+        self.value.add(value)
+
+    def get_value(self, sep):
+        return len(self.value)
+
+    def get_state(self):
+        return list(self.value)
+
+    def merge_state(self, state):
+        self.value.update(state)
+
+
+class HyperLogLog:
+    '''
+    HyperLogLog distinct count sketch with 2^P registers, about 1.6% standard error.
+
+    Registers are kept in a dictionary while few are set, then in a byte array.
+    Values are hashed with BLAKE2, so sketches built by different processes can be merged.
+    '''
+    P = 12
+    M = 1 << P
+    SPARSE_MAX = 64
+    ALPHA = 0.7213 / (1 + 1.079 / M)
+
+    def __init__(self):
+        self.registers = {}
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        j = x >> (64 - HyperLogLog.P)
+        rank = 64 - HyperLogLog.P - (x & ((1 << (64 - HyperLogLog.P)) - 1)).bit_length() + 1
+        self.set_register(j, rank)
+
+    def set_register(self, j, rank):
+        registers = self.registers
+        if isinstance(registers, dict):
+            if rank > registers.get(j, 0):
+                registers[j] = rank
+                if len(registers) > HyperLogLog.SPARSE_MAX:
+                    self.registers = bytearray(HyperLogLog.M)
+                    for i, r in registers.items():
+                        self.registers[i] = r
+        elif rank > registers[j]:
+            registers[j] = rank
+
+    def items(self):
+        if isinstance(self.registers, dict):
+            return self.registers.items()
+        return ((j, r) for (j, r) in enumerate(self.registers) if r)
+
+    def merge(self, registers):
+        if isinstance(registers, dict):
+            registers = registers.items()
+        else:
+            registers = ((j, r) for (j, r) in enumerate(registers) if r)
+        for j, rank in registers:
+            self.set_register(j, rank)
+
+    def count(self):
+        m = HyperLogLog.M
+        ranks = [r for (_, r) in self.items()]
+        zeros = m - len(ranks)
+        estimate = HyperLogLog.ALPHA * m * m / (zeros + sum(2.0 ** -r for r in ranks))
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class ApproxDistinct(Aggregator):
+    def __init__(self):
+        Aggregator.__init__(self, HyperLogLog())
+
+    def add_value(self, value):
+        self.value.add(value)
+
+    def get_value(self, sep):
+        return self.value.count()
+
+    def get_state(self):
+        registers = self.value.registers
+        return dict(registers) if isinstance(registers, dict) else bytes(registers)
+
+    def merge_state(self, state):
+        self.value.merge(state)
+
+
+class KLL:
+    '''
+    KLL quantile sketch (Karnin, Lang and Liberty) of capacity K.
+
+    Items at level h stand for 2^h items; compactions alternate between odd and even items so results do not depend on a random generator.
+    Quantiles are exact as long as fewer than K items were added.
+    '''
+    K = 200
+    C = 2.0 / 3.0
+
+    def __init__(self):
+        self.compactors = [[]]
+        self.offsets = [0]
+        self.size = 0
+        self.max_size = self.capacity(0)
+
+    def capacity(self, h):
+        return max(int(math.ceil(KLL.K * KLL.C ** (len(self.compactors) - h - 1))), 2)
+
+    def add(self, x):
+        self.compactors[0].append(x)
+        self.size += 1
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        while self.size >= self.max_size:
+            for h, items in enumerate(self.compactors):
+                if len(items) >= self.capacity(h):
+                    break
+            if h + 1 == len(self.compactors):
+                self.compactors.append([])
+                self.offsets.append(0)
+            items.sort()
+            rest = [items.pop()] if len(items) % 2 else []
+            self.compactors[h + 1].extend(items[self.offsets[h]::2])
+            self.offsets[h] = 1 - self.offsets[h]
+            self.compactors[h] = rest
+            self.size = sum(len(c) for c in self.compactors)
+            self.max_size = sum(self.capacity(i) for i in range(len(self.compactors)))
+
+    def merge(self, compactors):
+        while len(self.compactors) < len(compactors):
+            self.compactors.append([])
+            self.offsets.append(0)
+        for items, other in zip(self.compactors, compactors):
+            items.extend(other)
+        self.size = sum(len(c) for c in self.compactors)
+        self.max_size = sum(self.capacity(i) for i in range(len(self.compactors)))
+        self.compress()
+
+    def quantile(self, q):
+        '''Returns the smallest item whose rank reaches q times the number of items, None if the sketch is empty.'''
+        weighted = sorted((x, 1 << h) for (h, items) in enumerate(self.compactors) for x in items)
+        target = q * sum(w for (_, w) in weighted)
+        rank = 0
+        for x, w in weighted:
+            rank += w
+            if rank >= target:
+                return x
+        return None
+
+
+class Quantile(NumericAggregator):
+    def __init__(self, number_type, strict=False, p=0.5):
+        NumericAggregator.__init__(self, number_type, strict)
+        self.value = KLL()
+        self.p = p
+
+    def add_number(self, value):
+        self.value.add(value)
+
+    def add_missing(self):
+        pass
+
+    def get_value(self, sep):
+        q = self.value.quantile(self.p)
+        return '' if q is None else q
+
+    def get_state(self):
+        return self.value.compactors
+
+    def merge_state(self, state):
+        self.value.merge(state)
+
+
+class TopK(Aggregator):
+    '''Most frequent values, estimated with the Space-Saving algorithm (Metwally, Agrawal and El Abbadi) with COUNTERS times k counters.'''
+    COUNTERS = 4
+
+    def __init__(self, k):
+        Aggregator.__init__(self, {})
+        self.k = k
+        self.capacity = TopK.COUNTERS * k
+
+    def add_value(self, value):
+        counters = self.value
+        if value in counters:
+            counters[value] += 1
+        elif len(counters) < self.capacity:
+            counters[value] = 1
+        else:
+            victim = min(counters, key=counters.get)
+            counters[value] = counters.pop(victim) + 1
+
+    def get_value(self, sep):
+        return sep.join(str(x) for x in sorted(self.value, key=self.value.get, reverse=True)[:self.k])
+
+    def get_state(self):
+        return self.value
+
+    def merge_state(self, state):
+        counters = self.value
+        for value, count in state.items():
+            counters[value] = counters.get(value, 0) + count
+        if len(counters) > self.capacity:
+            kept = set(sorted(counters, key=counters.get, reverse=True)[:self.capacity])
+            self.value = dict((value, count) for (value, count) in counters.items() if value in kept)
+
+
+class Column:
+    '''Aggregation state of one column for all groups, indexed by group code.'''
+    def __init__(self, init_value, values=None):
+        self.init_value = init_value
+        self.values = [] if values is None else values
+
+    def grow(self, n):
+        self.values.extend(itertools.repeat(self.init_value, n - len(self.values)))
+
+    def add_values(self, codes, values):
+        raise NotImplementedError()
+
+    def get_value(self, code, sep):
+        return self.values[code]
+
+    @staticmethod
+    def create(aggregator_type):
+        if isinstance(aggregator_type, partial):
+            cls, args = aggregator_type.func, aggregator_type.args
+        else:
+            cls, args = aggregator_type, ()
+        if cls in COLUMNS:
+            return COLUMNS[cls](*args)
+        return ObjectColumn(aggregator_type)
+
+
+class IgnoreColumn(Column):
+    def __init__(self):
+        Column.__init__(self, None)
+
+    def grow(self, n):
+        pass
+
+    def add_values(self, codes, values):
+        pass
+
+
+class FirstColumn(Column):
+    def __init__(self):
+        Column.__init__(self, None)
+
+    def add_values(self, codes, values):
+        first = self.values
+        for c, v in zip(codes, values):
+            if first[c] is None:
+                first[c] = v
+
+
+class LastColumn(Column):
+    def __init__(self):
+        Column.__init__(self, None)
+
+    def add_values(self, codes, values):
+        last = self.values
+        for c, v in zip(codes, values):
+            last[c] = v
+
+
+class CountColumn(Column):
+    def __init__(self):
+        Column.__init__(self, 0, array('q'))
+
+    def add_values(self, codes, values):
+        count = self.values
+        for c in codes:
+            count[c] += 1
+
+
+class SumColumn(Column):
+    def __init__(self, number_type, strict=False):
+        Column.__init__(self, number_type(0), array('d') if number_type is float else None)
+        self.number_type = number_type
+        self.strict = strict
+
+    def add_values(self, codes, values):
+        sums = self.values
+        number_type = self.number_type
+        for c, v in zip(codes, values):
+            try:
+                x = number_type(v)
+            except ValueError as e:
+                if self.strict:
+                    raise e
+                continue
+            sums[c] += x
+
+
+class MeanColumn(SumColumn):
+    def __init__(self, number_type, strict=False):
+        SumColumn.__init__(self, number_type, strict)
+        self.counts = array('q')
+
+    def grow(self, n):
+        SumColumn.grow(self, n)
+        self.counts.extend(itertools.repeat(0, n - len(self.counts)))
+
+    def add_values(self, codes, values):
+        sums = self.values
+        counts = self.counts
+        number_type = self.number_type
+        for c, v in zip(codes, values):
+            try:
+                x = number_type(v)
+            except ValueError as e:
+                if self.strict:
+                    raise e
+                continue
+            sums[c] += x
+            counts[c] += 1
+
+    def get_value(self, code, sep):
+        return float(self.values[code]) / self.counts[code]
+
+
+class ValuesColumn(Column):
+    def __init__(self):
+        Column.__init__(self, None)
+
+    def grow(self, n):
+        self.values.extend({} for _ in range(n - len(self.values)))
+
+    def add_values(self, codes, values):
+        sets = self.values
+        for c, v in zip(codes, values):
+            sets[c][v] = None
+
+    def get_value(self, code, sep):
+        return sep.join(str(x) for x in self.values[code])
+
+
+class ObjectColumn(Column):
+    '''Fallback for aggregators without a column implementation, holds one aggregator object per group.'''
+    def __init__(self, aggregator_type):
+        Column.__init__(self, None)
+        self.aggregator_type = aggregator_type
+
+    def grow(self, n):
+        self.values.extend(self.aggregator_type() for _ in range(n - len(self.values)))
+
+    def add_values(self, codes, values):
+        aggregators = self.values
+        for c, v in zip(codes, values):
+            aggregators[c].add_value(v)
+
+    def get_value(self, code, sep):
+        return self.values[code].get_value(sep)
+
+
+COLUMNS = {
+    Ignore: IgnoreColumn,
+    First: FirstColumn,
+    Group: FirstColumn,
+    Last: LastColumn,
+    Count: CountColumn,
+    Sum: SumColumn,
+    Mean: MeanColumn,
+    Values: ValuesColumn,
+}
+
+
+class ColumnarEngine:
+    '''
+    Aggregates chunks of rows column by column.
+
+    Groups are numbered in the order of their first row, each column keeps the state of all groups in flat arrays indexed by group number.
+    The output is the same as the output of TAggro.
+    '''
+    CHUNK_SIZE = 1024
+
+    def __init__(self, aggregator_types, group_indexes):
+        self.columns = tuple(Column.create(at) for at in aggregator_types)
+        self.outputs = tuple(c for (c, at) in zip(self.columns, aggregator_types) if at is not Ignore)
+        self.group_indexes = group_indexes
+        self.codes = {}
+
+    def group_codes(self, rows):
+        codes = self.codes
+        if len(self.group_indexes) == 1:
+            g = self.group_indexes[0]
+            keys = (row[g] for row in rows)
+        else:
+            keys = (tuple(row[i] for i in self.group_indexes) for row in rows)
+        result = []
+        for key in keys:
+            c = codes.get(key)
+            if c is None:
+                c = codes[key] = len(codes)
+            result.append(c)
+        return result
+
+    def read_rows(self, rows):
+        codes = self.group_codes(rows)
+        n = len(self.codes)
+        width = len(self.columns)
+        for column in self.columns:
+            column.grow(n)
+        if min(len(row) for row in rows) >= width:
+            for column, values in zip(self.columns, zip(*rows)):
+                column.add_values(codes, values)
+            return
+        for j, column in enumerate(self.columns):
+            present = [(c, row[j]) for (c, row) in zip(codes, rows) if len(row) > j]
+            if present:
+                column.add_values(*zip(*present))
+
+    def read_file(self, f, sep='\t'):
+        stderr.write('separator: %s\n' % str(sep))
+        while True:
+            rows = [(line[:-1] if line[-1] == '\n' else line).split(sep) for line in itertools.islice(f, ColumnarEngine.CHUNK_SIZE)]
+            if not rows:
+                break
+            self.read_rows(rows)
+
+    def rows(self, list_sep):
+        for code in range(len(self.codes)):
+            yield (column.get_value(code, list_sep) for column in self.outputs)
+
+
+def parse_size(s):
+    '''Parses a size in bytes with an optional K, M, G or T suffix.'''
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    s = s.strip().upper().rstrip('B')
+    if s and s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+
+def deep_size(obj):
+    '''Estimates the memory used by a group key or by aggregators.'''
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(deep_size(x) for x in obj)
+    elif isinstance(obj, dict):
+        size += sum(deep_size(k) for k in obj)
+    elif isinstance(obj, Aggregator):
+        size += sys.getsizeof(obj.__dict__) + deep_size(obj.value)
+    return size
+
+
+class SpillingTable:
+    '''
+    Group table of aggregator objects that spills to temporary files when its estimated size exceeds a memory budget.
+
+    On spill, the state of every group is written to one of PARTITIONS files according to the hash of its key, and the following rows are appended to the file of their group.
+    Each partition is then aggregated separately, by restoring the states and reading the rows in their original order, and partitions are merged back in the order of the first row of each group.
+    The output is thus the same as the output of TAggro.
+    '''
+    PARTITIONS = 16
+    CHECK_ROWS = 4096
+    SAMPLE = 16
+    MAX_DEPTH = 4
+
+    def __init__(self, aggregator_types, group_indexes, max_memory, depth=0, tmp_dir=None):
+        self.aggregator_types = aggregator_types
+        self.group_indexes = group_indexes
+        self.max_memory = max_memory
+        self.depth = depth
+        self.tmp_dir = tmp_dir
+        self.table = {}
+        self.first = {}
+        self.row_count = 0
+        self.partitions = None
+
+    def new_aggregators(self):
+        return tuple(at() for at in self.aggregator_types)
+
+    def estimate_size(self):
+        keys = list(itertools.islice(self.table, SpillingTable.SAMPLE)) + list(itertools.islice(reversed(self.table), SpillingTable.SAMPLE))
+        sample = sum(deep_size(k) + deep_size(self.table[k]) for k in keys)
+        return sample * len(self.table) // len(keys)
+
+    def add_row(self, row_index, cols):
+        group = tuple(cols[i] for i in self.group_indexes)
+        if self.partitions is not None:
+            pickle.dump(('r', row_index, cols), self.partition(group), pickle.HIGHEST_PROTOCOL)
+            return
+        aggregators = self.table.get(group)
+        if aggregators is None:
+            aggregators = self.table[group] = self.new_aggregators()
+            self.first[group] = row_index
+        for agg, val in zip(aggregators, cols):
+            agg.add_value(val)
+        if row_index % SpillingTable.CHECK_ROWS == 0 and self.depth < SpillingTable.MAX_DEPTH and len(self.table) >= SpillingTable.PARTITIONS and self.estimate_size() > self.max_memory:
+            self.spill()
+
+    def restore(self, first, group, states):
+        if self.partitions is not None:
+            pickle.dump(('s', first, group, states), self.partition(group), pickle.HIGHEST_PROTOCOL)
+            return
+        aggregators = self.new_aggregators()
+        for agg, state in zip(aggregators, states):
+            agg.merge_state(state)
+        self.table[group] = aggregators
+        self.first[group] = first
+
+    def partition(self, group):
+        return self.partitions[hash((self.depth, group)) % SpillingTable.PARTITIONS]
+
+    def spill(self):
+        stderr.write('spilling %d groups to disk\n' % len(self.table))
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='taggro-')
+        self.partitions = [tempfile.TemporaryFile(dir=self.tmp_dir) for _ in range(SpillingTable.PARTITIONS)]
+        for group, aggregators in self.table.items():
+            self.restore(self.first[group], group, tuple(agg.get_state() for agg in aggregators))
+        self.table = {}
+        self.first = {}
+
+    def read_file(self, f, sep='\t'):
+        stderr.write('separator: %s\n' % str(sep))
+        for line in f:
+            if line[-1] == '\n':
+                line = line[:-1]
+            self.row_count += 1
+            self.add_row(self.row_count, line.split(sep))
+
+    @staticmethod
+    def _records(f):
+        f.seek(0)
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+    def results(self, list_sep):
+        '''Yields pairs (first row index, output values) in the order of the first row of each group.'''
+        if self.partitions is None:
+            for group, aggregators in self.table.items():
+                yield self.first[group], [str(a.get_value(list_sep)) for a in aggregators if not isinstance(a, Ignore)]
+            return
+        runs = []
+        for f in self.partitions:
+            child = SpillingTable(self.aggregator_types, self.group_indexes, self.max_memory, self.depth + 1, self.tmp_dir)
+            for record in SpillingTable._records(f):
+                if record[0] == 's':
+                    child.restore(*record[1:])
+                else:
+                    child.add_row(*record[1:])
+            f.close()
+            run = tempfile.TemporaryFile(dir=self.tmp_dir)
+            for result in child.results(list_sep):
+                pickle.dump(result, run, pickle.HIGHEST_PROTOCOL)
+            runs.append(run)
+        self.partitions = None
+        for result in heapq.merge(*(SpillingTable._records(run) for run in runs), key=lambda r: r[0]):
+            yield result
+        for run in runs:
+            run.close()
+
+    def rows(self, list_sep):
+        try:
+            for _, values in self.results(list_sep):
+                yield values
+        finally:
+            if self.tmp_dir is not None:
+                shutil.rmtree(self.tmp_dir)
+
+
+def replays_numbers(aggregator_type):
+    '''Either partial results of this aggregator type must be merged by replaying numbers; merging float sums would change rounding.'''
+    return isinstance(aggregator_type, partial) and aggregator_type.func in (Sum, Mean) and aggregator_type.args[0] is float
+
+
+def partial_type(aggregator_type):
+    '''Returns the aggregator type used by workers to build partial results.'''
+    if replays_numbers(aggregator_type):
+        return partial(Numbers, *aggregator_type.args)
+    return aggregator_type
+
+
+CHUNK_MIN = 1024 ** 2
+CHUNK_MAX = 32 * 1024 ** 2
+STDIN_CHUNK_LINES = 65536
+
+
+def chunk_tasks(filenames, jobs):
+    '''Splits files into byte ranges, each range is aligned to line starts by the worker that reads it.'''
+    sizes = [os.path.getsize(filename) for filename in filenames]
+    chunk_size = min(max(sum(sizes) // (4 * jobs), CHUNK_MIN), CHUNK_MAX)
+    for filename, size in zip(filenames, sizes):
+        for start in range(0, max(size, 1), chunk_size):
+            yield filename, start, min(start + chunk_size, size)
+
+
+def read_chunk(filename, start, end):
+    '''Returns the lines that start between offsets start and end of a file, decoded like a file opened in text mode.'''
+    with open(filename, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        begin = f.tell()
+        if begin >= end:
+            return []
+        data = f.read(end - begin)
+        if not data.endswith(b'\n'):
+            data += f.readline()
+    return io.TextIOWrapper(io.BytesIO(data), encoding=locale.getpreferredencoding(False))
+
+
+def aggregate_chunk(tokens, sep, chunk):
+    '''Aggregates a chunk of lines, either a byte range of a file or a list of lines, in a worker process.
+
+    :Return value:
+    list of (group, states), in the order of the first row of each group in the chunk
+    '''
+    aggregator_types = tuple(partial_type(Aggregator.parse_token(t)) for t in tokens)
+    group_indexes = tuple(i for (i, at) in enumerate(aggregator_types) if at is Group)
+    lines = read_chunk(*chunk) if isinstance(chunk, tuple) else chunk
+    result = {}
+    for line in lines:
+        if line[-1] == '\n':
+            line = line[:-1]
+        cols = line.split(sep)
+        group = tuple(cols[i] for i in group_indexes)
+        aggregators = result.get(group)
+        if aggregators is None:
+            aggregators = result[group] = tuple(at() for at in aggregator_types)
+        for agg, val in zip(aggregators, cols):
+            agg.add_value(val)
+    return [(group, tuple(agg.get_state() for agg in aggregators)) for group, aggregators in result.items()]
+
+
+def stdin_chunks():
+    while True:
+        lines = list(itertools.islice(stdin, STDIN_CHUNK_LINES))
+        if not lines:
+            break
+        yield lines
+
 
 class TAggro(ArgumentParser):
     def __init__(self):
@@ -177,20 +914,121 @@ class TAggro(ArgumentParser):
         self.add_argument('-i', '--input', metavar='FILE', type=str, nargs=1, action='append', dest='input', default=[], help='input file')
         self.add_argument('-s', '--separator', metavar='CHAR', type=str, action='store', dest='separator', default='\t', help='column separator character (default: tab)')
         self.add_argument('-l', '--list-separator', metavar='SEP', type=str, action='store', dest='list_separator', default=', ', help='list separator (default: comma)')
+        self.add_argument('--max-memory', metavar='SIZE', type=parse_size, action='store', dest='max_memory', default=None, help='when the groups take more than SIZE bytes (suffixes K, M, G), spill them to temporary files and aggregate them by partition (default: no limit)')
+        self.add_argument('--sorted', action='store_true', dest='sorted', default=False, help='the input is sorted on the group columns (LC_ALL=C sort), output each group as soon as it is complete, in constant memory; fail on the first group out of order')
+        self.add_argument('-j', '--jobs', metavar='N', type=int, action='store', dest='jobs', default=1, help='aggregate chunks of the input in N worker processes and merge their results (default: 1)')
+        self.add_argument('--engine', metavar='ENGINE', type=str, action='store', dest='engine', choices=('object', 'columnar'), default='object', help='aggregation engine: object keeps one aggregator object per group and column, columnar aggregates chunks of rows into per-column arrays and uses much less memory with many groups (default: object)')
 
     def run(self):
         args = self.parse_args()
         self.aggregator_types = tuple(Aggregator.parse_token(a) for a in args.aggregators)
         self.group_indexes = tuple(i for (i, at) in enumerate(self.aggregator_types) if at is Group)
-        self.result = defaultdict(lambda: tuple(at() for at in self.aggregator_types))
-        if len(args.input) == 0:
-            self.read_file(stdin, args.separator)
+        if args.max_memory is not None and args.engine != 'object':
+            self.error('--max-memory requires the object engine')
+        if args.jobs < 1:
+            self.error('illegal number of jobs: %d' % args.jobs)
+        if args.jobs > 1 and (args.engine != 'object' or args.max_memory is not None):
+            self.error('--jobs requires the object engine without --max-memory')
+        if args.sorted and (args.engine != 'object' or args.max_memory is not None or args.jobs > 1):
+            self.error('--sorted cannot be combined with --engine, --max-memory or --jobs')
+        if args.sorted:
+            self.current_group = None
+            self.current = None
+            self.row_count = 0
+            if len(args.input) == 0:
+                self.read_sorted(stdin, args.separator, args.list_separator)
+            else:
+                for a in args.input:
+                    with open(a[0]) as f:
+                        self.read_sorted(f, args.separator, args.list_separator)
+            if self.current is not None:
+                self.write_aggregators(self.current, args.separator, args.list_separator)
+            return
+        if args.jobs > 1:
+            self.result = defaultdict(lambda: tuple(at() for at in self.aggregator_types))
+            self.read_parallel(args)
+            read_file = None
+        elif args.engine == 'columnar':
+            engine = ColumnarEngine(self.aggregator_types, self.group_indexes)
+            read_file = engine.read_file
+        elif args.max_memory is not None:
+            engine = SpillingTable(self.aggregator_types, self.group_indexes, args.max_memory)
+            read_file = engine.read_file
+        else:
+            self.result = defaultdict(lambda: tuple(at() for at in self.aggregator_types))
+            read_file = self.read_file
+        if read_file is None:
+            pass
+        elif len(args.input) == 0:
+            read_file(stdin, args.separator)
         else:
             for a in args.input:
-                self.read_filename(a[0], args.separator)
-        for cols in self.result.values():
-            stdout.write(args.separator.join(str(a.get_value(args.list_separator)) for a in cols if not isinstance(a, Ignore)))
-            stdout.write('\n')
+                with open(a[0]) as f:
+                    read_file(f, args.separator)
+        if args.jobs == 1 and (args.engine == 'columnar' or args.max_memory is not None):
+            rows = engine.rows(args.list_separator)
+        else:
+            rows = ((a.get_value(args.list_separator) for a in cols if not isinstance(a, Ignore)) for cols in self.result.values())
+        for values in rows:
+            self.write_values(values, args.separator)
+
+    def write_values(self, values, sep):
+        stdout.write(sep.join(str(v) for v in values))
+        stdout.write('\n')
+
+    def write_aggregators(self, aggregators, sep, list_sep):
+        self.write_values((a.get_value(list_sep) for a in aggregators if not isinstance(a, Ignore)), sep)
+
+    def read_sorted(self, f, sep, list_sep):
+        '''Reads rows sorted on the group columns, writes each group as soon as the next group starts.'''
+        stderr.write('separator: %s\n' % str(sep))
+        for line in f:
+            if line[-1] == '\n':
+                line = line[:-1]
+            cols = line.split(sep)
+            self.row_count += 1
+            group = tuple(cols[i] for i in self.group_indexes)
+            if group != self.current_group:
+                if self.current is not None:
+                    if group < self.current_group:
+                        raise ValueError('row %d: group %s follows %s, input is not sorted on the group columns' % (self.row_count, sep.join(group), sep.join(self.current_group)))
+                    self.write_aggregators(self.current, sep, list_sep)
+                self.current_group = group
+                self.current = tuple(at() for at in self.aggregator_types)
+            for agg, val in zip(self.current, cols):
+                agg.add_value(val)
+
+    def read_parallel(self, args):
+        '''Aggregates the input in worker processes, and merges partial results in input order.
+
+        At most twice as many chunks as workers are read ahead, so that a large standard input is not held in memory.
+        '''
+        filenames = [a[0] for a in args.input]
+        if filenames:
+            for _ in filenames:
+                stderr.write('separator: %s\n' % str(args.separator))
+            chunks = chunk_tasks(filenames, args.jobs)
+        else:
+            stderr.write('separator: %s\n' % str(args.separator))
+            chunks = stdin_chunks()
+        replays = tuple(replays_numbers(at) for at in self.aggregator_types)
+        fun = partial(aggregate_chunk, args.aggregators, args.separator)
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(fun, chunk))
+                if len(pending) >= 2 * args.jobs:
+                    self.merge_states(pending.popleft().result(), replays)
+            while pending:
+                self.merge_states(pending.popleft().result(), replays)
+
+    def merge_states(self, states, replays):
+        for group, group_states in states:
+            for agg, state, replay in zip(self.result[group], group_states, replays):
+                if replay:
+                    agg.merge_numbers(state)
+                else:
+                    agg.merge_state(state)
 
     def read_line(self, cols):
         group = tuple(cols[i] for i in self.group_indexes)